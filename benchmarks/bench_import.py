@@ -0,0 +1,154 @@
+"""
+Import benchmark: Generates an exercise with many teams (submissions, Korrektur.pdf, status.csv and
+tutors_team_ids.json) and measures
+
+- the status.csv lookups of all teams, once per team as before StatusIndex (the file is parsed twice for every team)
+  and once with a single shared StatusIndex,
+- a complete folder import of all teams with the current code.
+
+Usage (from the repository root):
+    python benchmarks/bench_import.py [--teams 2000] [--keep]
+
+The import part only uses Manager, so running the script on an older checkout gives the numbers before a change.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.manager import Manager  # noqa: E402
+from src.comment_utils import Settings  # noqa: E402
+
+try:
+    from src.comment_utils import StatusIndex  # noqa: E402
+except ImportError:
+    StatusIndex = None
+
+ID_KEY = "<Name>"
+TEMPLATE = "07_sortedset"
+
+
+def make_exercise(root: str, n_teams: int):
+    """
+    Creates an exercise folder in the StudOn layout. All teams are assigned to the tutor ID_KEY.
+
+    :return: Path of the exercise folder
+    """
+    base = os.path.join(root, "Uebung07")
+    code_dir = os.path.join(base, "Code_Abgaben", "Abgaben")
+    pdf_dir = os.path.join(base, "Korrektur_Abgaben", "Abgaben")
+    rows = []
+    for t in range(1, n_teams + 1):
+        os.makedirs(os.path.join(code_dir, f"Team {t}"))
+        with open(os.path.join(code_dir, f"Team {t}", "SortedSet.java"), "w") as f:
+            f.write(f"public class SortedSet {{}} // Team {t}\n")
+        os.makedirs(os.path.join(pdf_dir, f"Team {t}"))
+        with open(os.path.join(pdf_dir, f"Team {t}", "Korrektur.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4\n" + os.urandom(2048))
+        rows.append({"team_id": t,
+                     "logins": f"ab{t:04d}cd, ef{t:04d}gh",
+                     "update": 0,
+                     "mark": "" if t % 3 else 5,
+                     "comment": f"Test 1: OK\nTest 2: Failed ({t})" if t % 2 else ""})
+    with open(os.path.join(pdf_dir, "status.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["team_id", "logins", "update", "mark", "comment"],
+                                quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(base, "tutors_team_ids.json"), "w", encoding="utf-8") as f:
+        json.dump({ID_KEY: [[t, t % 7 == 0, False] for t in range(1, n_teams + 1)]}, f)
+    return base
+
+
+def make_app_dir(root: str):
+    """
+    Creates the folders of a GUI installation (data, out, settings, ...) with the templates of this repository.
+
+    :return: Path of the app folder
+    """
+    app = os.path.join(root, "app")
+    for d in ["data", "out", "settings", ".cache", "logs"]:
+        os.makedirs(os.path.join(app, d))
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    shutil.copytree(os.path.join(repo, "templates"), os.path.join(app, "templates"))
+    Settings(compile_error_annotation="Compile Error :(",
+             plagiat_annotation="Plagiat :(",
+             filepath=os.path.join(app, "settings"),
+             id_key=ID_KEY).save()
+    return app
+
+
+def lookup_per_team(status_file: str, team_ids: list):
+    """
+    Lookups as done before StatusIndex: status.csv is parsed for the comment/mark and again for the logins of
+    every single team.
+    """
+    for team_id in team_ids:
+        for column in (["comment", "mark"], ["logins"]):
+            with open(status_file, encoding="utf-8", errors="backslashreplace") as f:
+                status_df = pd.read_csv(f)
+            id_col = [i for i in status_df.keys() if "id" in i][0]
+            status_df[id_col] = status_df[id_col].astype(str)
+            status_df.loc[status_df[id_col] == team_id, column].to_numpy()
+
+
+def lookup_index(status_file: str, team_ids: list):
+    """
+    Lookups with a single StatusIndex shared by all teams.
+    """
+    status_index = StatusIndex(status_file=status_file)
+    for team_id in team_ids:
+        status_index.get(team_id)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return time.perf_counter() - start, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the import of many teams")
+    parser.add_argument("--teams", type=int, default=2000, help="Number of generated teams")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated folders")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="aud_bench_")
+    try:
+        base = make_exercise(root, args.teams)
+        status_file = os.path.join(base, "Korrektur_Abgaben", "Abgaben", "status.csv")
+        team_ids = [str(t) for t in range(1, args.teams + 1)]
+        print(f"{args.teams} teams in \"{root}\"")
+
+        if StatusIndex is not None:
+            t_index, _ = timed(lookup_index, status_file, team_ids)
+            t_per_team, _ = timed(lookup_per_team, status_file, team_ids)
+            print(f"status.csv lookups, parsed per team: {t_per_team:8.2f} s")
+            print(f"status.csv lookups, StatusIndex:     {t_index:8.2f} s")
+
+        manager = Manager(make_app_dir(root))
+        res = [base, TEMPLATE]
+        if hasattr(manager, "prepare_import"):
+            t_import, errors = timed(lambda: manager.import_data(manager.prepare_import(res)))
+        else:
+            t_import, errors = timed(manager.import_data, res)
+        print(f"Folder import ({len(manager.states)} teams):     {t_import:8.2f} s")
+        if errors:
+            print(f"Import errors: {errors}")
+    finally:
+        if args.keep:
+            print(f"Kept \"{root}\"")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
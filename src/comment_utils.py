@@ -1,8 +1,13 @@
 import os
+import copy
+import threading
+from array import array
 import shutil
 import json
+import logging
 import pandas as pd
-from tkinter import messagebox
+
+from src.io_utils import atomic_write_json
 
 
 class Settings:
@@ -11,6 +16,8 @@ class Settings:
                  plagiat_annotation: str = "",
                  filepath: str = "",
                  id_key: str = "",
+                 use_session_store: bool = False,
+                 export_compression: str = "auto",
                  json_file: str = ""):
         if json_file != "":
             # Initialization via json dict
@@ -22,6 +29,10 @@ class Settings:
                     json_data["plagiat_annotation"] = ""
                 if "id_key" not in json_data.keys():
                     json_data["id_key"] = "<Name>"
+                if "use_session_store" not in json_data.keys():
+                    json_data["use_session_store"] = False
+                if "export_compression" not in json_data.keys():
+                    json_data["export_compression"] = "auto"
                 self.__dict__.update(json_data)
         else:
             self.settings_path = os.path.join(filepath, "settings.json")
@@ -29,6 +40,8 @@ class Settings:
             self.compile_error_annotation = compile_error_annotation
             self.plagiat_annotation = plagiat_annotation
             self.id_key = id_key
+            self.use_session_store = use_session_store
+            self.export_compression = export_compression
 
     def save(self):
         """
@@ -38,6 +51,362 @@ class Settings:
             json.dump(self.__dict__, f, indent=4, ensure_ascii=False)
 
 
+class StateError(Exception):
+    """
+    Raised if a new state cannot be created for a team.
+    """
+    pass
+
+
+class StatusIndex:
+    def __init__(self, status_file: str):
+        """
+        Parses status.csv once and maps every team id to its mark, comment and logins.
+        Shared by all states of an import, so the file is not read again for every team.
+        Does not open any dialogs (may be used by worker threads), problems are stored in error.
+
+        :param status_file: Path to status.csv
+        """
+        self.status_csv = status_file
+        self.id_col = ""
+        self.dataframe = None
+        self.teams = {}  # Team id (str) -> {"mark": ..., "comment": ..., "logins": ...}
+        self.valid = False
+        self.error = ""
+
+        # Try to load status.csv
+        try:
+            with open(self.status_csv, encoding="utf-8", errors="backslashreplace") as input_fd:
+                status_df = pd.read_csv(input_fd)
+        except OSError:
+            self.error = f"status.csv liegt nicht unter dem Pfad \"{self.status_csv}\"!"
+            return
+
+        # Find column with ID (Could be team_id or usr_id)
+        try:
+            self.id_col = [i for i in status_df.keys() if "id" in i][0]
+        except IndexError:
+            self.error = "Keine Spalte für Team-IDs in \"status.csv\" gefunden!"
+            return
+        status_df[self.id_col] = status_df[self.id_col].astype(str)
+        self.dataframe = status_df
+
+        # Build the lookup table in a single pass over the rows
+        comments = status_df["comment"].fillna(value="")
+        logins = status_df["logins"].fillna(value="") if "logins" in status_df else [""] * len(status_df)
+        for team_id, mark, comment, login in zip(status_df[self.id_col], status_df["mark"], comments, logins):
+            self.teams[team_id] = {"mark": None if pd.isna(mark) else mark,
+                                   "comment": comment,
+                                   "logins": login}
+        self.valid = True
+
+    def get(self, team_id):
+        """
+        :param team_id: ID of the team
+        :return: Dict with "mark", "comment" and "logins" or None if the team is not listed
+        """
+        return self.teams.get(str(team_id))
+
+    def __contains__(self, team_id):
+        return str(team_id) in self.teams
+
+
+class ValidationReport:
+    def __init__(self):
+        """
+        Problems found before an export. Errors prevent the export, warnings have to be confirmed.
+        """
+        self.errors = []  # List of (team id or None, message)
+        self.warnings = []
+        self.n_teams = 0
+        # Read while validating and reused by the export (see Manager.prepare_export)
+        self.status_index = None
+        self.pdf_paths = {}  # Team id -> path to Korrektur.pdf or None
+
+    def add_error(self, message: str, team_id: str = None):
+        self.errors.append((team_id, message))
+
+    def add_warning(self, message: str, team_id: str = None):
+        self.warnings.append((team_id, message))
+
+    def ok(self):
+        """
+        :return: True if the export is possible
+        """
+        return len(self.errors) == 0
+
+    def text(self):
+        """
+        :return: Report grouped by errors and warnings, one line per problem
+        """
+        lines = [f"{self.n_teams} Teams geprüft: {len(self.errors)} Fehler, {len(self.warnings)} Warnungen"]
+        for title, problems in (("Fehler", self.errors), ("Warnungen", self.warnings)):
+            if problems:
+                lines += ["", f"{title}:"]
+                lines += [f"  Team {team_id}: {message}" if team_id is not None else f"  {message}"
+                          for team_id, message in problems]
+        return "\n".join(lines)
+
+
+class Journal:
+    def __init__(self, path: str = ""):
+        """
+        Append-only journal (one JSON object per line) of the grading changes of a correction since the last save of
+        the states. Events store absolute values, so replaying them on top of any newer state.json is harmless.
+
+        :param path: Path to the journal file, an empty path disables the journal
+        """
+        self.path = path
+        self.size = 0  # Number of events in the file
+        if self.path and os.path.isfile(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.size = sum(1 for _ in f)
+
+    def append(self, event: dict):
+        """
+        Appends a single event and flushes it to disk.
+        """
+        if not self.path:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self.size += 1
+
+    def extend(self, events: list):
+        """
+        Appends several events with a single write.
+        """
+        if not self.path or len(events) == 0:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events))
+        self.size += len(events)
+
+    def read(self):
+        """
+        Reads all events (rotated ones first). An incomplete line (crash while writing) is ignored.
+
+        :return: Dict team id (str) -> list of events in order
+        """
+        events = {}
+        if not self.path:
+            return events
+        for path in (self.path + ".old", self.path):
+            if not os.path.isfile(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"comment_utils.py: Skip invalid journal line \"{line.strip()}\"")
+                        continue
+                    events.setdefault(str(event["team"]), []).append(event)
+        return events
+
+    def rotate(self):
+        """
+        Moves the current events aside before the states are saved. New events go to a new file, the rotated ones are
+        kept until clear_rotated is called after the states were written.
+        """
+        if not self.path or not os.path.isfile(self.path):
+            return
+        old_path = self.path + ".old"
+        if os.path.isfile(old_path):
+            # Previous save failed => Keep its events as well
+            with open(self.path, "r", encoding="utf-8") as src, open(old_path, "a", encoding="utf-8") as dst:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, old_path)
+        self.size = 0
+
+    def clear_rotated(self):
+        """
+        Removes the rotated events, called after the states were saved.
+        """
+        if self.path and os.path.isfile(self.path + ".old"):
+            os.remove(self.path + ".old")
+
+    def clear(self):
+        """
+        Removes all events, called after the states were saved.
+        """
+        for path in (self.path + ".old", self.path):
+            if self.path and os.path.isfile(path):
+                os.remove(path)
+        self.size = 0
+
+
+class Template:
+    def __init__(self, comment: dict):
+        """
+        Immutable structure of a comment template (titles and max points of all classes and tasks). Compiled once
+        and shared by all states using the same template, use Template.compile.
+
+        :param comment: Comment in the state.json format
+        """
+        self.class_titles = tuple(c["title"] for c in comment["classes"])
+        self.task_titles = tuple(t["title"] for c in comment["classes"] for t in c["tasks"])
+        self.task_max = array("d", (t["points"]["max"] for c in comment["classes"] for t in c["tasks"]))
+        self.class_max = tuple(c["points"]["max"] for c in comment["classes"])
+        self.total_max = comment["total_points"]["max"]
+        # Tasks of class i are task_titles[class_start[i]:class_start[i + 1]]
+        class_start = [0]
+        for c in comment["classes"]:
+            class_start.append(class_start[-1] + len(c["tasks"]))
+        self.class_start = tuple(class_start)
+        # Title lookups, (class_idx, task_idx) by (class_title, task_title)
+        self.class_idx = {c_title: i for i, c_title in enumerate(self.class_titles)}
+        self.task_idx = {(c_title, self.task_titles[j]): (i, j - class_start[i])
+                         for i, c_title in enumerate(self.class_titles)
+                         for j in range(class_start[i], class_start[i + 1])}
+        self.renderer = FeedbackRenderer(self)
+
+    @staticmethod
+    def compile(comment: dict):
+        """
+        :param comment: Comment in the state.json format
+        :return: Shared Template of the comment structure
+        """
+        key = json.dumps([comment["total_points"]["max"],
+                          [[c["title"], c["points"]["max"], [[t["title"], t["points"]["max"]] for t in c["tasks"]]]
+                           for c in comment["classes"]]], ensure_ascii=False)
+        with _templates_lock:
+            if key not in _templates:
+                _templates[key] = Template(comment)
+            return _templates[key]
+
+    def task_index(self, class_idx: int, task_idx: int):
+        """
+        :return: Index of the task in the flat point array
+        """
+        return self.class_start[class_idx] + task_idx
+
+
+_templates = {}  # Compiled templates by structure
+_templates_lock = threading.Lock()
+
+
+class Grading:
+    __slots__ = ("template", "points", "class_sums", "task_sum", "total", "compile_error", "plagiat")
+
+    def __init__(self, template: Template, points: array, total: float, compile_error: bool, plagiat: bool):
+        """
+        Points and flags of a single team. The structure is kept in the shared template.
+
+        :param points: Actual points of all tasks (flat, in template order)
+        """
+        self.template = template
+        self.points = points
+        # Sums are kept up to date by set_task_points, a change only adds its delta
+        self.class_sums = array("d", (sum(points[template.class_start[i]:template.class_start[i + 1]])
+                                      for i in range(len(template.class_titles))))
+        self.task_sum = sum(self.class_sums)
+        self.total = total
+        self.compile_error = compile_error
+        self.plagiat = plagiat
+
+    @staticmethod
+    def from_comment(comment: dict):
+        """
+        :param comment: Comment in the state.json format
+        """
+        return Grading(template=Template.compile(comment),
+                       points=array("d", (t["points"]["actual"] for c in comment["classes"] for t in c["tasks"])),
+                       total=comment["total_points"]["actual"],
+                       compile_error=comment["compile_error"],
+                       plagiat=comment.get("plagiat", False))
+
+    def to_comment(self):
+        """
+        :return: Comment in the state.json format
+        """
+        t = self.template
+        classes = []
+        for i, c_title in enumerate(t.class_titles):
+            start, end = t.class_start[i], t.class_start[i + 1]
+            classes.append({"title": c_title,
+                            "points": {"actual": self.class_sums[i], "max": t.class_max[i]},
+                            "tasks": [{"title": t.task_titles[j],
+                                       "points": {"actual": self.points[j], "max": t.task_max[j]}}
+                                      for j in range(start, end)]})
+        return {"total_points": {"actual": self.total, "max": t.total_max},
+                "compile_error": self.compile_error,
+                "classes": classes,
+                "plagiat": self.plagiat}
+
+    def total_points(self):
+        return {"actual": self.total, "max": self.template.total_max}
+
+    def class_points(self, class_idx: int):
+        return {"actual": self.class_sums[class_idx], "max": self.template.class_max[class_idx]}
+
+    def task_points(self, class_idx: int, task_idx: int):
+        i = self.template.task_index(class_idx, task_idx)
+        return {"actual": self.points[i], "max": self.template.task_max[i]}
+
+    def set_task_points(self, class_idx: int, task_idx: int, actual: float):
+        """
+        Sets the points of a task, limited to [0, max], and updates the class and task sums by the difference.
+        """
+        i = self.template.task_index(class_idx, task_idx)
+        actual = min(max(actual, 0.), self.template.task_max[i])
+        delta = actual - self.points[i]
+        self.points[i] = actual
+        self.class_sums[class_idx] += delta
+        self.task_sum += delta
+
+    def update_total(self):
+        """
+        Sets the total points to the sum of all tasks (0 in case of a compile error or plagiat).
+        """
+        if self.compile_error or self.plagiat:
+            self.total = 0.
+        else:
+            self.total = min(self.task_sum, self.template.total_max)
+
+
+class FeedbackRenderer:
+    def __init__(self, template: Template):
+        """
+        Feedback text of a template (see State.export), compiled once per template: Titles, max points and the lines
+        of tasks with full points are formatted in advance, rendering only fills in the actual points.
+        """
+        self.total_suffix = f" von {template.total_max} Punkten\n"
+        # Per class: (header prefix, header suffix, index of the first task, [(full points line, line suffix)])
+        self.classes = []
+        for i, c_title in enumerate(template.class_titles):
+            lines = []
+            for j in range(template.class_start[i], template.class_start[i + 1]):
+                suffix = f" / {template.task_max[j]}  |  {template.task_titles[j]}\n"
+                lines.append((f"✓   {template.task_max[j]}{suffix}", suffix))
+            self.classes.append((f"\n{c_title} (", f" / {template.class_max[i]}):\n", template.class_start[i], lines))
+        self.task_max = template.task_max
+
+    def render(self, grading: Grading, compile_error_annotation: str, plagiat_annotation: str):
+        """
+        :return: Feedback text of a team (without the personal annotation)
+        """
+        parts = ["Gesamt: ", str(grading.total), self.total_suffix]
+        if grading.plagiat:
+            parts.append(f"\n{plagiat_annotation}\n")
+        elif grading.compile_error:
+            parts.append(f"\n{compile_error_annotation}\n")
+        else:
+            points = grading.points
+            task_max = self.task_max
+            for i, (prefix, suffix, start, lines) in enumerate(self.classes):
+                parts += (prefix, str(grading.class_sums[i]), suffix)
+                for j, (full_line, line_suffix) in enumerate(lines, start):
+                    actual = points[j]
+                    if actual == task_max[j]:
+                        parts.append(full_line)
+                    else:
+                        parts += ("✗   " if actual == 0.0 else "~   ", str(actual), line_suffix)
+        return "".join(parts)
+
+
 class State:
     def __init__(self, team_id: str = "",
                  template_file: str = "",
@@ -46,19 +415,17 @@ class State:
                  status_file: str = "",
                  compile_error: bool = False,
                  plagiat: bool = False,
-                 json_file: str = ""):
-        if json_file != "":
+                 json_file: str = "",
+                 status_index: StatusIndex = None,
+                 manifest_entry: dict = None,
+                 store=None,
+                 save: bool = True):
+        if manifest_entry is not None:
+            # Lazy initialization via session manifest (or session store), the state is only read on first access
+            self._set_lazy(manifest_entry, store)
+        elif json_file != "":
             # Initialization via json dict
-            with open(json_file, "r", encoding="utf-8") as f:
-                json_data = json.load(f)
-                self.__dict__.update(json_data)
-                # Update logins attribute if it is not already there
-                if not hasattr(self, "logins"):
-                    logins = self.get_logins()
-                    if logins:
-                        self.logins = logins
-                if "plagiat" not in self.comment.keys():
-                    self.comment["plagiat"] = plagiat
+            self._load_json(json_file, status_index)
         else:
             # New instance
             self.id = int(team_id)
@@ -79,127 +446,302 @@ class State:
                     os.remove(os.path.join(pdf_dir, i))
 
             self.status_filepath = os.path.join(pdf_dir, "state.json")
-            # Copy template file
-            shutil.copyfile(src=template_file, dst=self.status_filepath)
+            # Copy template file (not needed if the state is kept in a session store, see save)
+            if save:
+                shutil.copyfile(src=template_file, dst=self.status_filepath)
 
             self.status_csv = status_file
 
             # Extract template
-            with open(self.status_filepath, "r", encoding="utf-8") as f:
+            with open(template_file, "r", encoding="utf-8") as f:
                 d = json.load(f)
 
-            # Define comment
-            self.comment = d
+            # Define comment (compiled, the structure is shared with all other teams)
+            self._grading = Grading.from_comment(d)
             # Update comment compile-error attribute
-            self.comment["compile_error"] = compile_error
+            self._grading.compile_error = compile_error
             # Add new plagiat attribute
-            self.comment["plagiat"] = plagiat
+            self._grading.plagiat = plagiat
 
             # Set total points correct
             if compile_error or plagiat:
-                self.comment["total_points"]["actual"] = 0.
+                self._grading.total = 0.
 
-            # Try to load status.csv
-            try:
-                with open(self.status_csv, encoding="utf-8", errors="backslashreplace") as input_fd:
-                    status_df = pd.read_csv(input_fd)
-            except OSError:
-                messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                     message=f"status.csv liegt nicht unter dem Pfad \"{self.status_csv}\"!")
+            # Use the shared index if given, otherwise parse status.csv for this team only
+            if status_index is None:
+                status_index = StatusIndex(status_file=self.status_csv)
+            if not status_index.valid:
                 return
 
-            # Find column with ID (Could be team_id or usr_id)
-            try:
-                id_col = [i for i in status_df.keys() if "id" in i][0]
-            except IndexError:
-                messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                     message="Keine Spalte für Team-IDs in \"status.csv\" gefunden!")
-                return
-            status_df[id_col] = status_df[id_col].astype(str)
-            status_df["comment"] = status_df["comment"].fillna(value="")
+            # Feedback of the automatic tests and logins
+            self.update_status(status_index)
 
-            # Find row in dataframe and grab comment column value
-            try:
-                comment = status_df.loc[status_df[id_col] == str(self.id), "comment"].item()
-            except ValueError:
-                messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                     message=f"Team {self.id} nicht in \"status.csv\" gefunden!")
-                return
+            # Save as json
+            if save:
+                self.save()
 
-            # Grab current score
-            score = status_df.loc[status_df[id_col] == str(self.id), "mark"].item()
-            if pd.isna(score):
-                score_string = "Punktzahl: \n"
-            else:
-                score_string = "Punktzahl: " + str(score) + "\n"
+    def update_status(self, status_index: StatusIndex):
+        """
+        Reads the feedback of the automatic tests and the logins of this team from status.csv.
+        Raises a StateError if the team is not listed.
+        """
+        # Find row in index and grab comment value
+        entry = status_index.get(self.id)
+        if entry is None:
+            raise StateError(f"Team {self.id} nicht in \"status.csv\" gefunden!")
 
-            # Make score string first line of comment file
-            comment = score_string + comment
+        # Grab current score
+        if entry["mark"] is None:
+            score_string = "Punktzahl: \n"
+        else:
+            score_string = "Punktzahl: " + str(entry["mark"]) + "\n"
 
-            self.auto_correction_result = comment
+        # Make score string first line of comment file
+        self.auto_correction_result = score_string + entry["comment"]
 
-            # Add new logins attribute which keeps track of the IdMs
-            logins = self.get_logins()
-            if logins:
-                self.logins = logins
+        # Add new logins attribute which keeps track of the IdMs
+        logins = self.get_logins(status_index)
+        if logins:
+            self.logins = logins
 
-            # Save as json
-            self.save()
+    def get_logins(self, status_index: StatusIndex = None):
+        """
+        Does not open any dialogs, since states are also loaded on worker threads (import, export).
 
-    def get_logins(self):
-        try:
-            with open(self.status_csv, encoding="utf-8", errors="backslashreplace") as input_fd:
-                status_df = pd.read_csv(input_fd)
-        except OSError:
-            messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                 message=f"status.csv liegt nicht unter dem Pfad \"{self.status_csv}\"!")
+        :return: Logins of this team from status.csv, None if the team is not listed
+        """
+        if status_index is None:
+            status_index = StatusIndex(status_file=self.status_csv)
+        if not status_index.valid:
             return
 
-        # Find column with ID (Could be team_id or usr_id)
-        try:
-            id_col = [i for i in status_df.keys() if "id" in i][0]
-        except IndexError:
-            messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                 message="Keine Spalte für Team-IDs in \"status.csv\" gefunden!")
+        # Find row in index and grab logins value
+        entry = status_index.get(self.id)
+        if entry is None:
+            logging.warning(f"comment_utils.py: Team {self.id} not found in \"{status_index.status_csv}\", no logins")
             return
-        status_df[id_col] = status_df[id_col].astype(str)
-        status_df["logins"] = status_df["logins"].fillna(value="")
 
-        # Find row in dataframe and grab logins column value
-        try:
-            logins = status_df.loc[status_df[id_col] == str(self.id), "logins"].item()
-        except ValueError:
-            messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                 message=f"Team {self.id} nicht in \"status.csv\" gefunden!")
+        return entry["logins"].split(", ")  # separate at comma
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set => Load state.json of lazy states on first access
+        if not name.startswith("_") and self.__dict__.get("_lazy", False):
+            self._hydrate()
+            return getattr(self, name)
+        raise AttributeError(f"'State' object has no attribute '{name}'")
+
+    @property
+    def comment(self):
+        """
+        Comment in the state.json format, created from the grading (changes to it are not kept).
+        """
+        return self.grading.to_comment()
+
+    @property
+    def grading(self):
+        """
+        Points and flags of the team.
+        """
+        if not self.is_loaded():
+            self._hydrate()
+        return self._grading
+
+    def _set_data(self, data: dict):
+        # Data as saved in state.json
+        comment = data.pop("comment")
+        self.__dict__.update(data)
+        self._grading = Grading.from_comment(comment)
+
+    def _load_json(self, json_file: str, status_index: StatusIndex = None):
+        with open(json_file, "r", encoding="utf-8") as f:
+            json_data = json.load(f)
+            self._set_data(json_data)
+            # Update logins attribute if it is not already there
+            if "logins" not in self.__dict__:
+                logins = self.get_logins(status_index)
+                if logins:
+                    self.logins = logins
+
+    def _set_lazy(self, manifest_entry: dict, store=None):
+        # Only id, confirmed flag and the manifest entry (total points) stay in memory
+        self.id = int(manifest_entry["id"])
+        self.confirmed = manifest_entry["confirmed"]
+        self.status_filepath = manifest_entry["state_file"]
+        self._manifest_entry = manifest_entry
+        self._store = store  # SessionStore the state is read from (None => state.json)
+        self._lazy = True
+
+    def release(self, save: bool = True):
+        """
+        Drops the full state (comment, feedback, ...) from memory, it is read again on the next access.
+
+        :param save: Save the state before releasing it
+        """
+        if not self.is_loaded() or self.__dict__.get("_writing", False):
+            # States are released after a pending write (see snapshot), their manifest entry needs the new file
             return
+        if save and self.is_dirty():
+            self.save()
+        entry = self.summary()
+        store = self.__dict__.get("_store")
+        # The rendered feedback stays valid, a lazy state cannot be changed without loading it
+        cache = {k: self.__dict__[k] for k in ("_version", "_feedback") if k in self.__dict__}
+        self.__dict__.clear()
+        self._set_lazy(entry, store)
+        self.__dict__.update(cache)
 
-        return logins.split(", ")  # separate at comma
+    def _hydrate(self):
+        """
+        Reads the full state.json (or the session store entry) of a lazy state. The manifest entry is checked against
+        the modification time of the file, a confirmed flag changed in the meantime is kept.
+        """
+        entry = self._manifest_entry
+        store = self._store
+        self._lazy = False
+        confirmed = self.confirmed
+        if store is not None:
+            self._set_data(store.load(self.id))
+        else:
+            try:
+                mtime = os.path.getmtime(self.status_filepath)
+            except OSError:
+                mtime = None
+            if mtime != entry.get("mtime"):
+                logging.warning(f"comment_utils.py: Manifest entry of team {self.id} is outdated, "
+                                f"using \"{self.status_filepath}\"")
+                # Changed outside of the GUI, the rendered feedback may be outdated as well
+                self.__dict__.pop("_feedback", None)
+            self._load_json(self.status_filepath)
+        if confirmed != entry["confirmed"]:
+            self.confirmed = confirmed
 
-    def save(self):
+    def load(self):
         """
-        Saves the state as JSON file at the location stored in status_filepath
+        Reads the full state of a lazy state (see _hydrate), does nothing if it is already in memory.
         """
-        with open(self.status_filepath, "w", encoding="utf-8") as f:
-            json.dump(self.__dict__, f, indent=4, ensure_ascii=False)
+        if not self.is_loaded():
+            self._hydrate()
 
-    def export(self, compile_error_annotation: str, plagiat_annotation: str):
-        total = float(self.comment["total_points"]["actual"])
+    def is_loaded(self):
+        """
+        :return: True if the full state (comment, feedback, ...) is in memory
+        """
+        return not self.__dict__.get("_lazy", False)
 
-        res = f"Gesamt: {self.comment['total_points']['actual']} von {self.comment['total_points']['max']} Punkten\n"
+    def summary(self):
+        """
+        Entry of this state in the session manifest. Lazy states return their (updated) manifest entry.
 
-        if self.comment["plagiat"]:
-            res += f"\n{plagiat_annotation}\n"
-        elif self.comment["compile_error"]:
-            res += f"\n{compile_error_annotation}\n"
+        :return: Dict with id, confirmed flag, total points, path and modification time of state.json
+        """
+        if not self.is_loaded():
+            entry = dict(self._manifest_entry)
+            entry["confirmed"] = self.confirmed
+            return entry
+        try:
+            mtime = os.path.getmtime(self.status_filepath)
+        except OSError:
+            mtime = None
+        return {"id": self.id,
+                "confirmed": self.confirmed,
+                "total_points": self._grading.total_points(),
+                "state_file": self.status_filepath,
+                "mtime": mtime}
+
+    def update_total_points(self):
+        """
+        Sums up the task points of all classes and the total points (0 in case of a compile error or plagiat).
+        """
+        self.grading.update_total()
+
+    def apply_event(self, event: dict):
+        """
+        Applies a journal event (see Manager) to this state.
+
+        :param event: {"team": ..., "flag": "confirmed"|"compile_error"|"plagiat", "value": ...} or
+                      {"team": ..., "class": ..., "task": ..., "actual": ...}
+        """
+        grading = self.grading
+        if "flag" in event:
+            if event["flag"] == "confirmed":
+                self.confirmed = event["value"]
+            else:
+                setattr(grading, event["flag"], event["value"])
         else:
-            for i, c in enumerate(self.comment["classes"]):
-                res += f"\n{c['title']} ({c['points']['actual']} / {c['points']['max']}):\n"
-                for t in self.comment["classes"][i]["tasks"]:
-                    mark = "~"
-                    if t["points"]["actual"] == t["points"]["max"]:
-                        mark = "✓"
-                    elif t["points"]["actual"] == 0.0:
-                        mark = "✗"
-                    res += f"{mark}   {t['points']['actual']} / {t['points']['max']}  |  {t['title']}\n"
+            idx = grading.template.task_idx.get((event["class"], event["task"]))
+            if idx is not None:
+                grading.set_task_points(*idx, event["actual"])
+        self.update_total_points()
+        self.set_dirty()
 
+    def set_dirty(self):
+        """
+        Marks the state as changed since the last save. Also invalidates the rendered feedback (see export).
+        """
+        self._dirty = True
+        self._version = self.__dict__.get("_version", 0) + 1
+
+    def is_dirty(self):
+        """
+        :return: True if the state was changed since the last save
+        """
+        return self.__dict__.get("_dirty", False)
+
+    def version(self):
+        """
+        :return: Number of changes of this state (see set_dirty), kept while the state is released
+        """
+        return self.__dict__.get("_version", 0)
+
+    def snapshot(self):
+        """
+        Copy of everything stored in state.json, which can be written on another thread. Clears the dirty flag.
+        Lazy states are loaded first. The state is not released until written is called.
+
+        :return: JSON serializable dict
+        """
+        if not self.is_loaded():
+            self._hydrate()
+        self._dirty = False
+        self._writing = True
+        data = copy.deepcopy({k: v for k, v in self.__dict__.items() if not k.startswith("_")})
+        data["comment"] = self._grading.to_comment()
+        return data
+
+    def save(self):
+        """
+        Saves the state as JSON file at the location stored in status_filepath.
+        Lazy states are only written if they were changed (e.g. their confirmed flag).
+        """
+        lazy = not self.is_loaded()
+        if lazy and not self.is_dirty():
+            return
+        try:
+            atomic_write_json(self.status_filepath, self.snapshot())
+        finally:
+            self.written()
+        if lazy:
+            self.release(save=False)
+
+    def written(self):
+        """
+        Marks the snapshot of the state as written, the state may be released again.
+        """
+        self._writing = False
+
+    def export(self, compile_error_annotation: str, plagiat_annotation: str):
+        """
+        Feedback of the team as uploaded to StudOn (without the personal annotation). The text is cached until the
+        state is changed (see set_dirty), also while the state is released.
+
+        :return: (total points, feedback)
+        """
+        key = (self.version(), compile_error_annotation, plagiat_annotation)
+        cached = self.__dict__.get("_feedback")
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+        grading = self.grading
+        total = float(grading.total)
+        res = grading.template.renderer.render(grading, compile_error_annotation, plagiat_annotation)
+        self._feedback = (key, total, res)
         return total, res
@@ -194,6 +194,7 @@ class SettingsDialog(tk.Toplevel):
         self.plagiat = input_list[1]
         self.name = input_list[2]
         self.id_key = input_list[3]
+        self.use_session_store = tk.BooleanVar(value=input_list[4])
         self.save_func = save_func
 
         # WIDGETS
@@ -273,6 +274,26 @@ class SettingsDialog(tk.Toplevel):
                                    justify="left",
                                    bg=self.g.bg_color)
         self.info_label.pack(fill="x", side="top", anchor="w", padx=10, pady=5)
+        # Session store
+        self.store_label = tk.Label(self.scroll,
+                                    text="Speicherformat:",
+                                    anchor="w",
+                                    bg=self.g.bg_color,
+                                    font=(self.g.header_font, 14))
+        self.store_label.pack(fill="x", side="top", anchor="w", padx=10, pady=5)
+        self.store_checkbutton = tk.Checkbutton(self.scroll,
+                                                text="Neue Korrekturen in einer Datenbank speichern (session.db)",
+                                                variable=self.use_session_store,
+                                                anchor="w",
+                                                bg=self.g.bg_color)
+        self.store_checkbutton.pack(fill="x", side="top", anchor="w", padx=10, pady=5)
+        self.store_info_label = tk.Label(self.scroll,
+                                         text="INFO:\nStatt einer \"state.json\" pro Team wird eine einzige Datei "
+                                              "(\"session.db\") verwendet.\nGilt für neue Korrekturen.",
+                                         anchor="w",
+                                         justify="left",
+                                         bg=self.g.bg_color)
+        self.store_info_label.pack(fill="x", side="top", anchor="w", padx=10, pady=5)
         # Termination frame
         self.terminate_frame = tk.Frame(self.scroll, bg=self.g.bg_color)
 
@@ -297,7 +318,7 @@ class SettingsDialog(tk.Toplevel):
         plagiat = self.p_box.get("1.0", "end")
         comment = self.id_box.get("1.0", "end")
         id_key = self.id_key_entry.get()
-        res = [compile_error, plagiat, comment, id_key]
+        res = [compile_error, plagiat, comment, id_key, self.use_session_store.get()]
         self.destroy()
         self.save_func(res)
 
@@ -605,11 +626,80 @@ class FontsDialog(tk.Toplevel):
         self.text.pack(padx=10, pady=10)
 
 
+class ValidationDialog(tk.Toplevel):
+    def __init__(self,
+                 master,
+                 g: Graphics,
+                 report,
+                 continue_func):
+        """
+        Shows the result of the export validation. The export can only be continued without errors.
+
+        :param report: ValidationReport
+        :param continue_func: Called without arguments to continue the export
+        """
+        super().__init__(master=master)
+        self.title("AuD-GUI :D - Export prüfen")
+        self.resizable(True, True)
+        self.geometry("600x400")
+        self.focus_set()
+
+        # STATES
+        self.continue_func = continue_func
+
+        # WIDGETS
+        self.config(bg=g.bg_color)
+
+        # Summary label
+        if not report.ok():
+            summary = "Export nicht möglich, bitte zuerst die Fehler beheben."
+        elif report.warnings:
+            summary = "Export möglich, bitte die Warnungen beachten."
+        else:
+            summary = "Keine Probleme gefunden."
+        self.summary_label = tk.Label(self, text=summary, anchor="w", bg=g.bg_color, font=(g.header_font, 14))
+        self.summary_label.pack(padx=10, pady=5, anchor="w", fill="x")
+
+        # Report
+        self.text_frame = tk.Frame(self, bg=g.bg_color)
+        self.text = tk.Text(self.text_frame, wrap="none", height=15)
+        text_scroll = ttk.Scrollbar(self.text_frame, orient=tk.VERTICAL, command=self.text.yview)
+        self.text.configure(yscrollcommand=text_scroll.set)
+        text_scroll.pack(side="right", fill="y")
+        self.text.insert("1.0", report.text())
+        self.text.config(state="disabled")
+        self.text.pack(fill="both", expand=True)
+        self.text_frame.pack(padx=10, pady=5, fill="both", expand=True)
+
+        # Termination frame
+        self.terminate_frame = tk.Frame(self, bg=g.bg_color)
+
+        # Abort button
+        self.abort_button = tk.Button(self.terminate_frame, text="Abbrechen", bg=g.button_color,
+                                      command=self.abort)
+        self.abort_button.pack(padx=10, pady=5, anchor="e", side="right")
+
+        # Continue button
+        self.continue_button = tk.Button(self.terminate_frame, text="Weiter", bg=g.button_color,
+                                         command=self.accept, state="normal" if report.ok() else "disabled")
+        self.continue_button.pack(padx=10, pady=5, anchor="e", side="right")
+
+        self.terminate_frame.pack(padx=10, pady=5, anchor="w", fill="x")
+
+    def accept(self):
+        self.destroy()
+        self.continue_func()
+
+    def abort(self):
+        self.destroy()
+
+
 class ExportDialog(tk.Toplevel):
     def __init__(self,
                  master,
                  g: Graphics,
-                 export_func):
+                 export_func,
+                 compression: str = "auto"):
         super().__init__(master=master)
         self.title("AuD-GUI :D - Korrektur exportieren")
         self.resizable(True, True)
@@ -618,6 +708,11 @@ class ExportDialog(tk.Toplevel):
         # STATES
         self.export_folder = tk.StringVar(value="")
         self.export_func = export_func
+        self.compressions = {"PDFs unkomprimiert (schnell)": "auto",
+                             "Alles komprimieren (kleinste Datei)": "deflate",
+                             "Nichts komprimieren": "store"}
+        labels = {v: k for k, v in self.compressions.items()}
+        self.compression = tk.StringVar(value=labels.get(compression, labels["auto"]))
 
         # WIDGETS
         self.config(bg=g.bg_color)
@@ -640,6 +735,16 @@ class ExportDialog(tk.Toplevel):
                                    bg=g.bg_color)
         self.info_label.pack(padx=10, pady=5, anchor="w")
 
+        # Compression
+        self.compression_label = tk.Label(self, text="Komprimierung:", bg=g.bg_color)
+        self.compression_label.pack(padx=10, pady=5, anchor="w", side="top")
+        self.compression_box = ttk.Combobox(self,
+                                            state="readonly",
+                                            width=35,
+                                            values=list(self.compressions.keys()),
+                                            textvariable=self.compression)
+        self.compression_box.pack(padx=10, pady=5, anchor="w")
+
         # Termination frame
         self.terminate_frame = tk.Frame(self, bg=g.bg_color)
 
@@ -657,7 +762,201 @@ class ExportDialog(tk.Toplevel):
 
     def export_data(self):
         self.destroy()
-        self.export_func(self.export_folder.get())
+        self.export_func(self.export_folder.get(), self.compressions[self.compression.get()])
+
+    def abort(self):
+        self.destroy()
+
+
+class BulkDialog(tk.Toplevel):
+    def __init__(self,
+                 master,
+                 g: Graphics,
+                 tasks: dict,
+                 apply_func):
+        """
+        Dialog to apply the same change to several teams.
+
+        :param tasks: Task titles by class title (of the current template)
+        :param apply_func: Called with [team_ids (None => All), unconfirmed_only, feedback_pattern, class_str, task_str,
+                           delta, compile_error, plagiat], None for unchanged flags
+        """
+        super().__init__(master=master)
+        self.title("AuD-GUI :D - Mehrere Teams bewerten")
+        self.resizable(True, True)
+        self.focus_set()
+        self.g = g
+
+        # STATES
+        self.tasks = tasks
+        self.apply_func = apply_func
+        self.unconfirmed_only = tk.BooleanVar(value=False)
+        self.feedback_pattern = tk.StringVar(value="")
+        self.class_title = tk.StringVar(value="")
+        self.task_title = tk.StringVar(value="")
+        self.delta = tk.DoubleVar(value=0.)
+        self.flag_values = {"Unverändert": None, "Ja": True, "Nein": False}
+        self.compile_error = tk.StringVar(value="Unverändert")
+        self.plagiat = tk.StringVar(value="Unverändert")
+
+        # WIDGETS
+        self.config(bg=g.bg_color)
+
+        # Selection
+        self.selection_label = tk.Label(self, text="Auswahl der Teams:", anchor="w", bg=g.bg_color,
+                                        font=(g.header_font, 14))
+        self.selection_label.pack(padx=10, pady=5, anchor="w", fill="x")
+        self.id_label = tk.Label(self, text="Team-IDs (eine pro Zeile, leer => alle Teams):", anchor="w",
+                                 bg=g.bg_color)
+        self.id_label.pack(padx=10, anchor="w", fill="x")
+        self.id_box = tk.Text(self, width=20, height=6)
+        self.id_box.pack(padx=10, pady=5, anchor="w")
+        self.unconfirmed_checkbutton = tk.Checkbutton(self, text="Nur nicht bestätigte Teams",
+                                                      variable=self.unconfirmed_only, anchor="w", bg=g.bg_color)
+        self.unconfirmed_checkbutton.pack(padx=10, pady=5, anchor="w", fill="x")
+        self.pattern_label = tk.Label(self, text="Test Feedback enthält (regulärer Ausdruck, leer => beliebig):",
+                                      anchor="w", bg=g.bg_color)
+        self.pattern_label.pack(padx=10, anchor="w", fill="x")
+        self.pattern_entry = tk.Entry(self, width=50, textvariable=self.feedback_pattern)
+        self.pattern_entry.pack(padx=10, pady=5, anchor="w", fill="x")
+
+        # Change
+        self.change_label = tk.Label(self, text="Änderung:", anchor="w", bg=g.bg_color, font=(g.header_font, 14))
+        self.change_label.pack(padx=10, pady=5, anchor="w", fill="x")
+        self.task_frame = tk.Frame(self, bg=g.bg_color)
+        self.class_box = ttk.Combobox(self.task_frame, state="readonly", values=list(self.tasks.keys()),
+                                      textvariable=self.class_title)
+        self.class_box.bind("<<ComboboxSelected>>", self.select_class)
+        self.class_box.pack(side="left", padx=5)
+        self.task_box = ttk.Combobox(self.task_frame, state="readonly", values=[], textvariable=self.task_title)
+        self.task_box.pack(side="left", padx=5)
+        self.delta_box = tk.Spinbox(self.task_frame, from_=-100., to=100., increment=0.5, width=6,
+                                    textvariable=self.delta)
+        self.delta_box.pack(side="left", padx=5)
+        self.delta_label = tk.Label(self.task_frame, text="Punkte", bg=g.bg_color)
+        self.delta_label.pack(side="left")
+        self.task_frame.pack(padx=5, pady=5, anchor="w", fill="x")
+
+        self.flag_frame = tk.Frame(self, bg=g.bg_color)
+        self.compile_error_label = tk.Label(self.flag_frame, text="Compile Error:", bg=g.bg_color)
+        self.compile_error_label.grid(row=0, column=0, padx=5, pady=2, sticky="w")
+        self.compile_error_box = ttk.Combobox(self.flag_frame, state="readonly", values=list(self.flag_values.keys()),
+                                              textvariable=self.compile_error)
+        self.compile_error_box.grid(row=0, column=1, padx=5, pady=2, sticky="w")
+        self.plag_label = tk.Label(self.flag_frame, text="Plagiat:", bg=g.bg_color)
+        self.plag_label.grid(row=1, column=0, padx=5, pady=2, sticky="w")
+        self.plag_box = ttk.Combobox(self.flag_frame, state="readonly", values=list(self.flag_values.keys()),
+                                     textvariable=self.plagiat)
+        self.plag_box.grid(row=1, column=1, padx=5, pady=2, sticky="w")
+        self.flag_frame.pack(padx=5, pady=5, anchor="w", fill="x")
+
+        # Info label
+        self.info_label = tk.Label(self,
+                                   text="INFO:\nGeänderte Teams müssen erneut bestätigt werden.",
+                                   justify="left",
+                                   anchor="w",
+                                   bg=g.bg_color)
+        self.info_label.pack(padx=10, pady=5, anchor="w")
+
+        # Termination frame
+        self.terminate_frame = tk.Frame(self, bg=g.bg_color)
+
+        # Abort button
+        self.abort_button = tk.Button(self.terminate_frame, text="Abbrechen", bg=g.button_color,
+                                      command=self.abort)
+        self.abort_button.pack(padx=10, pady=5, anchor="e", side="right")
+
+        # Apply button
+        self.apply_button = tk.Button(self.terminate_frame, text="Anwenden", bg=g.button_color,
+                                      command=self.apply)
+        self.apply_button.pack(padx=10, pady=5, anchor="e", side="right")
+
+        self.terminate_frame.pack(padx=10, pady=5, anchor="w", fill="x")
+
+    def select_class(self, event):
+        self.task_box.config(values=list(self.tasks.get(self.class_title.get(), [])))
+        self.task_title.set("")
+
+    def apply(self):
+        team_ids = [i.strip() for i in self.id_box.get("1.0", "end").splitlines() if i.strip() != ""]
+        try:
+            delta = float(self.delta_box.get())
+        except ValueError:
+            delta = 0.
+        class_str = self.class_title.get() if self.task_title.get() != "" else None
+        res = [team_ids if len(team_ids) > 0 else None,
+               self.unconfirmed_only.get(),
+               self.feedback_pattern.get(),
+               class_str,
+               self.task_title.get() if class_str is not None else None,
+               delta,
+               self.flag_values[self.compile_error.get()],
+               self.flag_values[self.plagiat.get()]]
+        self.destroy()
+        self.apply_func(res)
 
     def abort(self):
         self.destroy()
+
+
+class ProgressDialog(tk.Toplevel):
+    def __init__(self,
+                 master,
+                 title: str,
+                 g: Graphics,
+                 cancel_func,
+                 modal: bool = True):
+        super().__init__(master=master)
+        self.title(title)
+        self.resizable(False, False)
+        self.focus_set()
+        self.transient(master)
+        if modal:
+            # Block the main window while the task is running
+            self.grab_set()
+
+        # STATES
+        self.cancel_func = cancel_func
+        self.text = tk.StringVar(value="")
+
+        # WIDGETS
+        self.config(bg=g.bg_color)
+
+        # Progress bar (indeterminate as long as the total is unknown)
+        self.progress_bar = ttk.Progressbar(self, orient="horizontal", length=350, mode="indeterminate")
+        self.progress_bar.pack(padx=10, pady=10, fill="x")
+        self.progress_bar.start(10)
+
+        # Info label
+        self.info_label = tk.Label(self, textvariable=self.text, anchor="w", bg=g.bg_color)
+        self.info_label.pack(padx=10, pady=5, anchor="w", fill="x")
+
+        # Abort button
+        self.abort_button = tk.Button(self, text="Abbrechen", bg=g.button_color, command=self.abort)
+        self.abort_button.pack(padx=10, pady=5, anchor="e")
+
+        # Closing the window cancels as well
+        self.protocol("WM_DELETE_WINDOW", self.abort)
+
+    def set_progress(self, text: str, done: int, total: int):
+        """
+        Show the current progress.
+
+        :param text: Text describing the current step
+        :param done: Finished units of work
+        :param total: Total units of work, 0 if unknown
+        """
+        self.text.set(text)
+        if total > 0:
+            if str(self.progress_bar.cget("mode")) != "determinate":
+                self.progress_bar.stop()
+                self.progress_bar.config(mode="determinate")
+            self.progress_bar.config(maximum=total, value=done)
+        elif str(self.progress_bar.cget("mode")) != "indeterminate":
+            self.progress_bar.config(mode="indeterminate")
+            self.progress_bar.start(10)
+
+    def abort(self):
+        self.text.set("Wird abgebrochen...")
+        self.abort_button.config(state="disabled")
+        self.cancel_func()
@@ -2,10 +2,16 @@ import tkinter as tk
 from tkinter import messagebox, simpledialog
 from tkinter import ttk
 import os
+import queue
+import re
+import threading
+import logging
 
-from src.gui_utils import Window, DoubleScrolledFrame, ClipboardApp
+from src.gui_utils import Window, DoubleScrolledFrame, ClipboardApp, StatisticsApp, PreviewApp
 from src.manager import Manager
-from src.dialogs import ImportDialog, ExportDialog, SettingsDialog, GraphicsDialog
+from src.dialogs import ImportDialog, ExportDialog, SettingsDialog, GraphicsDialog, ProgressDialog, BulkDialog, \
+    ValidationDialog
+from src.io_utils import ImportCancelled, ExportCancelled
 
 
 class AuDGUI(Window):
@@ -23,6 +29,16 @@ class AuDGUI(Window):
         self.active_left_frame = False
         self.active_right_frame = False
         self.active_progress_bar = False
+        # Background import
+        self.import_thread = None
+        self.import_cancel = threading.Event()
+        self.import_queue = queue.Queue()
+        # Background export (the teams can still be graded meanwhile)
+        self.export_thread = None
+        self.export_cancel = threading.Event()
+        self.export_queue = queue.Queue()
+        self.export_progress_dialog = None
+        self.progress_dialog = None
 
         # Menu
         # File menu
@@ -55,6 +71,7 @@ class AuDGUI(Window):
         self.edit_menu.add_command(label="Vorheriges Team", command=self.prev_folder, state="disabled")
         self.edit_menu.add_separator()
         self.edit_menu.add_command(label="Suche Team", command=self.search_folder, state="disabled")
+        self.edit_menu.add_command(label="Mehrere Teams bewerten", command=self.bulk_dialog, state="disabled")
         self.edit_menu.add_separator()
         self.edit_menu.add_command(label="PDF öffnen", command=self.open_pdf, state="disabled")
         self.edit_menu.add_separator()
@@ -139,8 +156,8 @@ class AuDGUI(Window):
 
         # Main scroll 1: Points --> parent = self.main_scroll1
         self.total_points_label = None
-        self.class_points_labels = []
-        self.task_points_labels = []
+        self.class_points_labels = {}
+        self.task_points_labels = {}
         self.compile_error_button = None
         self.plag_button = None
         self.confirm_button = None
@@ -201,6 +218,15 @@ class AuDGUI(Window):
         # self.clipboard_helper.pack(fill="both", expand=True)
         self.main_notebook.add(self.clipboard_helper, text="Kommentare")
 
+        # Main scroll 3: Statistics of all teams, updated when the tab is selected
+        self.statistics = StatisticsApp(self.main_notebook, self.g)
+        self.main_notebook.add(self.statistics, text="Statistik")
+
+        # Main scroll 4: Feedback of the current team as uploaded to StudOn, updated while it is selected
+        self.preview = PreviewApp(self.main_notebook, self.g)
+        self.main_notebook.add(self.preview, text="Vorschau")
+        self.main_notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
+
         self.update_graphics()
 
     def update_graphics(self):
@@ -259,6 +285,8 @@ class AuDGUI(Window):
                                    bg=self.g.bg_color)
 
         self.clipboard_helper.update_labels_graphics()
+        self.statistics.update_labels_graphics()
+        self.preview.update_labels_graphics()
 
     def _delete_main_frame(self):
         for li in [self.main_frames,
@@ -363,22 +391,22 @@ class AuDGUI(Window):
             self.main_frames.append(total_points_frame)
 
             # Classes --------------------------------------------------------------------------------------------------
-            for c in self.manager.team_state.comment["classes"]:
-                c_title, c_points = c["title"], c["points"]
+            for c_title in self.manager.get_class_titles():
+                c_points = self.manager.get_class_points(c_title)
                 c_label = tk.Label(self.main_scroll1,
                                    text=f"{c_title}: {c_points['actual']} / {c_points['max']}",
                                    anchor="w",
                                    relief="solid",
                                    bd=1)
-                self.class_points_labels.append((c_title, c_label))  # Store for correct config when changing points
+                self.class_points_labels[c_title] = c_label  # Store for correct config when changing points
                 c_label.pack(fill="x",
                              anchor="w",
                              padx=10,
                              pady=10)
                 self.main_class_title_labels.append(c_label)
                 # Tasks ------------------------------------------------------------------------------------------------
-                for t in self.manager.team_state.comment["classes"][self.manager.get_class_idx(c_title)]["tasks"]:
-                    t_title, t_points = t["title"], t["points"]
+                for t_title in self.manager.get_task_titles(c_title):
+                    t_points = self.manager.get_task_points(c_title, t_title)
                     # Task frame
                     t_frame = tk.Frame(self.main_scroll1)
                     # Minus button
@@ -398,7 +426,7 @@ class AuDGUI(Window):
                                         side="left",
                                         padx=5,
                                         pady=5)
-                    self.task_points_labels.append((c_title, t_title, t_points_label))  # Store for changing points text
+                    self.task_points_labels[(c_title, t_title)] = t_points_label  # Store for changing points text
                     # Plus button
                     t_plus_button = tk.Button(t_frame,
                                               text="+",
@@ -479,12 +507,18 @@ class AuDGUI(Window):
         """
         Save all states.
         """
-        # Save all other data
+        # Save all other data (waits for a running autosave)
         if self._ready():
-            self.manager.save()
+            self.manager.autosave.flush()
         self.clipboard_helper.save()
 
     def open_data(self):
+        if self.export_thread is not None:
+            messagebox.showerror(title="AuD-GUI :D - Fehler!",
+                                 message="Korrektur kann nicht gewechselt werden, solange ein Export läuft!")
+            return
+        # Save current corrections before switching
+        self.save()
         # Set team_ids
         success = self.manager.open_data()
         if success:
@@ -497,7 +531,8 @@ class AuDGUI(Window):
             # Configure menu
             self.file_menu.entryconfigure("Korrekturen exportieren", state="normal")
             # Update edit menu
-            for i in ["Nächstes Team", "Vorheriges Team", "Suche Team", "PDF öffnen", "Code öffnen"]:
+            for i in ["Nächstes Team", "Vorheriges Team", "Suche Team", "Mehrere Teams bewerten", "PDF öffnen",
+                      "Code öffnen"]:
                 self.edit_menu.entryconfigure(i, state="normal")
 
     def settings_dialog(self):
@@ -508,9 +543,14 @@ class AuDGUI(Window):
                        input_list=[self.manager.settings.compile_error_annotation,
                                    self.manager.settings.plagiat_annotation,
                                    self.manager.settings.personal_annotation,
-                                   self.manager.settings.id_key],
+                                   self.manager.settings.id_key,
+                                   self.manager.settings.use_session_store],
                        g=self.g,
-                       save_func=self.manager.save_personal_comment)
+                       save_func=self._save_personal_comment)
+
+    def _save_personal_comment(self, comments: list):
+        self.manager.save_personal_comment(comments)
+        self._render_preview()
 
     def graphics_dialog(self):
         """
@@ -538,18 +578,86 @@ class AuDGUI(Window):
         """
         Save, Check and Export current states.
         """
-        if self._ready():
+        if self._ready() and self.export_thread is None and not self.active_progress_bar:
             self.save()  # Save before exporting
-            # Check if all teams were confirmed
-            for s in self.manager.states:
-                if not s.confirmed:
-                    continue_export = messagebox.askokcancel(title="AuD-GUI :D - Warnung!",
-                                                             message=f"Team {s.id} wurde noch nicht bestätigt!\n"
-                                                                     f"Trotzdem fortfahren?")
-                    if not continue_export:
-                        return
-            # Continue if all teams were confirmed or manually passed to export via messagebox
-            ExportDialog(self, g=self.g, export_func=self.manager.export)
+            # Check teams, PDFs and status.csv before anything is written
+            report = self.manager.validate_export()
+            if report.ok() and not report.warnings:
+                self._export_dialog(report)
+            else:
+                ValidationDialog(self, g=self.g, report=report, continue_func=lambda: self._export_dialog(report))
+
+    def _export_dialog(self, report):
+        ExportDialog(self, g=self.g,
+                     export_func=lambda folder_name, compression: self._continue_export(folder_name, compression,
+                                                                                      report),
+                     compression=self.manager.settings.export_compression)
+
+    def _continue_export(self, folder_name: str, compression: str, report):
+        if self.export_thread is not None or self.active_progress_bar:
+            return
+        # Ask everything before the export runs in the background (status.csv and folders are reused from the report)
+        plan = self.manager.prepare_export(folder_name, compression, report)
+        if plan is None:
+            return
+        self.export_cancel.clear()
+        self.export_progress_dialog = ProgressDialog(self,
+                                                     title="AuD-GUI :D - Korrektur exportieren",
+                                                     g=self.g,
+                                                     cancel_func=self.export_cancel.set,
+                                                     modal=False)
+        self.export_thread = threading.Thread(target=self._export_worker, args=(plan,), daemon=True)
+        self.export_thread.start()
+        self.after(100, self._poll_export)
+
+    def _export_worker(self, plan: dict):
+        """
+        Runs the export on a worker thread, the results are passed to the GUI thread via the export queue.
+        """
+        def progress(text, done, total):
+            self.export_queue.put(("progress", (text, done, total)))
+
+        try:
+            errors, changed_teams = self.manager.export(plan, progress=progress, cancel=self.export_cancel)
+            self.export_queue.put(("done", (plan["zip_path"], errors, changed_teams)))
+        except ExportCancelled:
+            self.export_queue.put(("cancelled", None))
+        except Exception as e:
+            logging.exception("gui.py: Export failed")
+            self.export_queue.put(("failed", str(e)))
+
+    def _poll_export(self):
+        """
+        Handles the messages of the export worker and finishes the export on the GUI thread.
+        """
+        while True:
+            try:
+                kind, value = self.export_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                self.export_progress_dialog.set_progress(*value)
+                continue
+            # Worker finished
+            self.export_thread = None
+            self.export_progress_dialog.destroy()
+            self.export_progress_dialog = None
+            if kind == "done":
+                zip_path, errors, changed_teams = value
+                if len(errors) > 0:
+                    messagebox.showerror(title="AuD-GUI :D - Fehler!", message="\n".join(errors))
+                # Teams without Korrektur.pdf are only reported, the zip file is written anyway
+                if os.path.isfile(zip_path):
+                    if len(changed_teams) > 0:
+                        messagebox.showwarning(title="AuD-GUI :D - Warnung!",
+                                               message=f"Teams {', '.join(changed_teams)} wurden während des Exports "
+                                                       f"geändert und sind mit ihrem vorherigen Stand exportiert!\n"
+                                                       f"Bitte erneut exportieren.")
+                    self.manager.open_export_folder(zip_path)
+            elif kind == "failed":
+                messagebox.showerror(title="AuD-GUI :D - Fehler!", message=f"Export fehlgeschlagen!\n{value}")
+            return
+        self.after(100, self._poll_export)
 
     def next_folder(self):
         """
@@ -583,6 +691,45 @@ class AuDGUI(Window):
                 else:
                     self._open_team(found_idx)
 
+    def bulk_dialog(self):
+        """
+        Create BulkDialog to change several teams at once.
+        """
+        if self._ready() and not self.active_progress_bar:
+            BulkDialog(master=self,
+                       g=self.g,
+                       tasks={c: self.manager.get_task_titles(c) for c in self.manager.get_class_titles()},
+                       apply_func=self._bulk_change)
+
+    def _bulk_change(self, res: list):
+        """
+        Apply the result of the BulkDialog to all selected teams.
+
+        :param res: [team_ids, unconfirmed_only, feedback_pattern, class_str, task_str, delta, compile_error, plagiat]
+        """
+        team_ids, unconfirmed_only, feedback_pattern, class_str, task_str, delta, compile_error, plagiat = res
+        if (class_str is None or delta == 0) and compile_error is None and plagiat is None:
+            messagebox.showerror(title="AuD-GUI :D - Fehler!", message="Keine Änderung ausgewählt!")
+            return
+        try:
+            indices = self.manager.find_teams(team_ids, unconfirmed_only, feedback_pattern)
+        except re.error as e:
+            messagebox.showerror(title="AuD-GUI :D - Fehler!",
+                                 message=f"Ungültiger regulärer Ausdruck \"{feedback_pattern}\":\n{e}")
+            return
+        if len(indices) == 0:
+            messagebox.showerror(title="AuD-GUI :D - Fehler!", message="Keine passenden Teams gefunden!")
+            return
+        permission = messagebox.askyesno(title="AuD-GUI :D - Warnung!",
+                                         message=f"Änderung auf {len(indices)} Teams anwenden?\n"
+                                                 f"({', '.join(self.manager.team_list[i] for i in indices[:20])}"
+                                                 f"{', ...' if len(indices) > 20 else ''})")
+        if permission:
+            changed = self.manager.bulk_change(indices, class_str, task_str, delta, compile_error, plagiat)
+            # Show the changes of the current team
+            self._open_team(self.manager.team_idx)
+            messagebox.showinfo(title="AuD-GUI :D", message=f"{changed} Teams geändert.")
+
     def open_pdf(self):
         """
         Open the corresponding PDF file for correction.
@@ -606,9 +753,72 @@ class AuDGUI(Window):
         return len(self.manager.states) > 0
 
     def _continue_import(self, res: list):
-        self.manager.team_idx = 0
-        # Load directory
-        self.manager.import_data(res)
+        if self.active_progress_bar or self.export_thread is not None:
+            if self.export_thread is not None:
+                messagebox.showerror(title="AuD-GUI :D - Fehler!",
+                                     message="Korrektur kann nicht gewechselt werden, solange ein Export läuft!")
+            return
+        # Save current corrections before switching (the import may replace their folder)
+        self.save()
+        # Ask everything before the import runs in the background
+        plan = self.manager.prepare_import(res)
+        if plan is None:
+            return
+
+        self.active_progress_bar = True
+        self.import_cancel.clear()
+        self.progress_dialog = ProgressDialog(self,
+                                              title="AuD-GUI :D - Abgaben importieren",
+                                              g=self.g,
+                                              cancel_func=self.import_cancel.set)
+        self.import_thread = threading.Thread(target=self._import_worker, args=(plan,), daemon=True)
+        self.import_thread.start()
+        self.after(100, self._poll_import)
+
+    def _import_worker(self, plan: dict):
+        """
+        Runs the import on a worker thread. The results are passed to the GUI thread via the import queue,
+        since Tk must only be used by the GUI thread.
+        """
+        def progress(text, done, total):
+            self.import_queue.put(("progress", (text, done, total)))
+
+        try:
+            errors = self.manager.import_data(plan, progress=progress, cancel=self.import_cancel)
+            self.import_queue.put(("done", errors))
+        except ImportCancelled:
+            self.import_queue.put(("cancelled", None))
+        except Exception as e:
+            logging.exception("gui.py: Import failed")
+            self.import_queue.put(("failed", str(e)))
+
+    def _poll_import(self):
+        """
+        Handles the messages of the import worker and finishes the import on the GUI thread.
+        """
+        while True:
+            try:
+                kind, value = self.import_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                self.progress_dialog.set_progress(*value)
+                continue
+            # Worker finished
+            self.active_progress_bar = False
+            self.import_thread = None
+            self.progress_dialog.destroy()
+            self.progress_dialog = None
+            if kind == "done":
+                if len(value) > 0:
+                    messagebox.showerror(title="AuD-GUI :D - Fehler!", message="\n".join(value))
+                self._finish_import()
+            elif kind == "failed":
+                messagebox.showerror(title="AuD-GUI :D - Fehler!", message=f"Import fehlgeschlagen!\n{value}")
+            return
+        self.after(100, self._poll_import)
+
+    def _finish_import(self):
         # Change status back and forth to refresh scroll region (call 2 times)
         self._create_team_sidebar_buttons()
         self._create_feedback_label()
@@ -621,12 +831,26 @@ class AuDGUI(Window):
         # Configure export menu
         self.file_menu.entryconfigure("Korrekturen exportieren", state="normal")
         # Update edit menu
-        for i in ["Nächstes Team", "Vorheriges Team", "Suche Team", "PDF öffnen", "Code öffnen"]:
+        for i in ["Nächstes Team", "Vorheriges Team", "Suche Team", "Mehrere Teams bewerten", "PDF öffnen",
+                  "Code öffnen"]:
             self.edit_menu.entryconfigure(i, state="normal")
 
+    def close(self):
+        """
+        Cancel a running import or export (which removes the partial import or zip file) before closing the
+        application.
+        """
+        if self.import_thread is not None:
+            self.import_cancel.set()
+            self.import_thread.join()
+        if self.export_thread is not None:
+            self.export_cancel.set()
+            self.export_thread.join()
+        super().close()
+
     def _open_team(self, index: int):
-        # Save if old team was opened
-        self.save()
+        # Grading changes are journaled by the manager, only save the annotations
+        self.clipboard_helper.save()
 
         self.manager.open_team(index)
         # Update labels
@@ -634,12 +858,13 @@ class AuDGUI(Window):
         # self._color_sidebar()
         self._create_feedback_label()
         self._color_sidebar()
+        self._render_preview()
 
     def _switch_confirm(self):
         """
         Switch the confirm state.
         """
-        self.manager.team_state.confirmed = not self.manager.team_state.confirmed
+        self.manager.switch_confirmed()
         self._render_confirm()  # Change widgets
 
     def _render_confirm(self):
@@ -652,6 +877,25 @@ class AuDGUI(Window):
             self.confirm_button.configure(text="Nicht bestätigt", bg="#ffcccb")
         self._color_sidebar()  # Colors the team sidebar buttons
 
+    def _on_tab_changed(self, event):
+        """
+        Update the statistics and the preview tab when they are selected.
+        """
+        if self.main_notebook.select() == str(self.statistics) and self._ready() and not self.active_progress_bar:
+            self.statistics.update_statistics(self.manager.get_points_matrix())
+        self._render_preview()
+
+    def _render_preview(self):
+        """
+        Show the feedback of the current team in the preview tab (only while it is selected).
+        """
+        if self.main_notebook.select() != str(self.preview):
+            return
+        if self._ready() and self.manager.team_state is not None and not self.active_progress_bar:
+            self.preview.update_preview(self.manager.get_id(), self.manager.get_feedback())
+        else:
+            self.preview.update_preview()
+
     def _increase_task_points(self, class_str: str, task_str: str):
         """
         Increase task points by 0.5 points.
@@ -664,7 +908,7 @@ class AuDGUI(Window):
             self._switch_confirm()
 
         self.manager.increase_task_points(class_str, task_str)
-        self._render_points_labels()  # Adjust the widgets to match the points of the current state
+        self._render_points_labels(class_str, task_str)  # Adjust the widgets of the task to match its points
 
     def _decrease_task_points(self, class_str: str, task_str: str):
         """
@@ -678,25 +922,34 @@ class AuDGUI(Window):
             self._switch_confirm()
 
         self.manager.decrease_task_points(class_str, task_str)
-        self._render_points_labels()  # Adjust the widgets to match the points of the current state
+        self._render_points_labels(class_str, task_str)  # Adjust the widgets of the task to match its points
 
-    def _render_points_labels(self):
+    def _render_points_labels(self, class_str: str = None, task_str: str = None):
         """
         Adjust the point label widgets to match the points of the current state.
+
+        :param class_str: Class of the changed task, None => Render all labels
+        :param task_str: Title of the changed task
         """
         if self.total_points_label is not None:
-            # Update and retrieve total points
-            self.manager.update_total_points()
+            # Retrieve total points
             p = self.manager.get_total_points()
             self.total_points_label.configure(text=f"Total: {p['actual']} / {p['max']}")
+            if class_str is not None:
+                class_labels = [(class_str, self.class_points_labels[class_str])]
+                task_labels = [((class_str, task_str), self.task_points_labels[(class_str, task_str)])]
+            else:
+                class_labels = self.class_points_labels.items()
+                task_labels = self.task_points_labels.items()
             # Update class labels
-            for t, i in self.class_points_labels:
+            for t, i in class_labels:
                 p = self.manager.get_class_points(t)
                 i.configure(text=f"{t}: {p['actual']} / {p['max']}")
             # Update task labels
-            for c, t, i in self.task_points_labels:
+            for (c, t), i in task_labels:
                 p = self.manager.get_task_points(c, t)
                 i.configure(text=f"{p['actual']} / {p['max']}")
+        self._render_preview()
 
     def _switch_compile_error(self):
         """
@@ -5,7 +5,10 @@ import os
 import json
 from abc import abstractmethod
 
+import numpy as np
+
 from src.graphics import Graphics
+from src.io_utils import atomic_write_json
 
 
 class Window(tk.Tk):
@@ -171,6 +174,7 @@ class ClipboardApp(tk.Frame):
         self.selected_category = -1
         self.g = g
         self.path_to_data_file = path_to_data
+        self.changed = False  # Only save if annotations were changed
 
         # Widgets
         self.sidebar_buttons: list[tk.Button] = []
@@ -298,6 +302,7 @@ class ClipboardApp(tk.Frame):
                 messagebox.showerror(title="Fehler", message=f"Kategorie \"{c.title}\" existiert bereits!", parent=self)
                 return
             self.data.append(c)
+            self.changed = True
             self.update_sidebar()
 
     def delete_category(self):
@@ -308,6 +313,7 @@ class ClipboardApp(tk.Frame):
                                              parent=self)
             if permission:
                 self.data.remove(self.data[self.selected_category])
+                self.changed = True
                 self.selected_category = -1
                 self.update_sidebar()
                 self.update_main_frame()
@@ -375,6 +381,7 @@ class ClipboardApp(tk.Frame):
             annotation = simpledialog.askstring(title="Anmerkung hinzufügen", prompt="Text:" + "\t" * 10, parent=self)
             if annotation is not None:
                 self.data[self.selected_category].add_annotation(annotation)
+                self.changed = True
                 self.update_main_frame()
 
     def delete_annotation(self, x: str):
@@ -384,6 +391,7 @@ class ClipboardApp(tk.Frame):
                                              parent=self)
             if permission:
                 self.data[self.selected_category].delete_annotation(x)
+                self.changed = True
                 self.update_main_frame()
 
     def copy_to_clipboard(self, content: str):
@@ -393,13 +401,15 @@ class ClipboardApp(tk.Frame):
         self.update()
 
     def save(self):
+        if not self.changed:
+            return
         save_data = []
         for c in self.data:
             save_data.append({"title": c.title, "annotations": c.annotations})
 
         # Write the data to a JSON file
-        with open(os.path.join(self.path_to_data_file), "w", encoding="utf-8") as f:
-            json.dump(save_data, f, indent=4, ensure_ascii=False)  # indent=4 is optional but makes it pretty-printed
+        atomic_write_json(self.path_to_data_file, save_data)
+        self.changed = False
 
     def load(self):
         if os.path.isfile(self.path_to_data_file):
@@ -417,3 +427,183 @@ class ClipboardApp(tk.Frame):
         self.clipboard_clear()
         self.save()
         self.destroy()
+
+
+class StatisticsApp(tk.Frame):
+    def __init__(self, master, g: Graphics):
+        """
+        Tab showing the point distribution of all teams: Per-task statistics, histograms of the class points and of
+        the total points.
+        """
+        super().__init__(master=master)
+        self.g = g
+
+        self.title = tk.Label(self,
+                              text="Statistik",
+                              relief="solid")
+        self.title.pack(fill="x", side="top")
+        self.summary_label = tk.Label(self, text="Keine Korrektur geöffnet", anchor="w", justify="left")
+        self.summary_label.pack(fill="x", side="top", padx=10, pady=5)
+
+        # Per-task table
+        columns = ("task", "max", "mean", "median", "min", "best", "lost")
+        headings = ("Aufgabe", "Max", "Mittelwert", "Median", "Min", "Max erreicht", "Ø Abzug")
+        self.table_frame = tk.Frame(self)
+        self.table = ttk.Treeview(self.table_frame, columns=columns, show="tree headings")
+        self.table.heading("#0", text="Klasse")
+        for c, h in zip(columns, headings):
+            self.table.heading(c, text=h, command=lambda x=c: self.sort_table(x))
+            self.table.column(c, width=90 if c != "task" else 220, anchor="w" if c == "task" else "e")
+        table_scroll = ttk.Scrollbar(self.table_frame, orient=tk.VERTICAL, command=self.table.yview)
+        self.table.configure(yscrollcommand=table_scroll.set)
+        table_scroll.pack(side="right", fill="y")
+        self.table.pack(fill="both", expand=True)
+        self.table_frame.pack(fill="both", expand=True, padx=10, pady=5)
+
+        # Histograms
+        self.histogram_text = tk.Text(self, height=12, wrap="none", relief="flat")
+        self.histogram_text.pack(fill="both", padx=10, pady=5)
+        self.histogram_text.configure(state="disabled")
+
+        self.update_labels_graphics()
+
+    def update_statistics(self, matrix):
+        """
+        Show the statistics of a points matrix.
+
+        :param matrix: PointsMatrix of all teams (see Manager.get_points_matrix), None => Clear the tab
+        """
+        self.table.delete(*self.table.get_children())
+        self._set_histogram_text("")
+        if matrix is None or matrix.n_teams() == 0:
+            self.summary_label.configure(text="Keine Korrektur geöffnet")
+            return
+
+        t = matrix.template
+        totals = matrix.totals[matrix.valid]
+        self.summary_label.configure(text=f"Teams: {matrix.n_teams()} (Compile-Error/Plagiat: {matrix.n_flagged()})\t"
+                                          f"Gesamt: Ø {totals.mean():.2f} / Median {float(np.median(totals)):.2f} "
+                                          f"von {t.total_max} Punkten")
+        lines = ["Gesamtpunkte:"] + self._histogram_lines(*matrix.total_histogram())
+        # Tasks and classes without teams with compile error or plagiat
+        stats = matrix.task_stats()
+        if stats is not None:
+            for i, c_title in enumerate(t.class_titles):
+                parent = self.table.insert("", "end", text=c_title, open=True)
+                for j in range(t.class_start[i], t.class_start[i + 1]):
+                    self.table.insert(parent, "end", text="",
+                                      values=(t.task_titles[j], t.task_max[j],
+                                              f"{stats['mean'][j]:.2f}", f"{stats['median'][j]:.2f}",
+                                              stats["min"][j], stats["max"][j], f"{stats['mean_lost'][j]:.2f}"))
+            for c_title, (counts, edges) in zip(t.class_titles, matrix.class_histograms()):
+                lines += ["", f"{c_title}:"] + self._histogram_lines(counts, edges)
+        self._set_histogram_text("\n".join(lines))
+
+    def sort_table(self, column: str):
+        """
+        Sort the tasks of every class by a column (descending).
+        """
+        for parent in self.table.get_children():
+            children = list(self.table.get_children(parent))
+            children.sort(key=lambda x: self._sort_key(self.table.set(x, column)), reverse=True)
+            for idx, child in enumerate(children):
+                self.table.move(child, parent, idx)
+
+    @staticmethod
+    def _sort_key(value: str):
+        try:
+            return 0, float(value)
+        except ValueError:
+            return 1, value
+
+    @staticmethod
+    def _histogram_lines(counts, edges, width: int = 40):
+        """
+        :return: One text line (bin range, bar and count) per bin
+        """
+        most = max(int(counts.max()), 1)
+        lines = []
+        for i in range(len(counts)):
+            bar = "█" * round(width * counts[i] / most)
+            lines.append(f"  {edges[i]:6.1f} - {edges[i + 1]:6.1f} | {bar:<{width}} {counts[i]}")
+        return lines
+
+    def _set_histogram_text(self, text: str):
+        self.histogram_text.configure(state="normal")
+        self.histogram_text.delete("1.0", "end")
+        self.histogram_text.insert("1.0", text)
+        self.histogram_text.configure(state="disabled")
+
+    def update_labels_graphics(self):
+        self.config(bg=self.g.bg_color)
+        self.table_frame.config(bg=self.g.bg_color)
+        self.title.config(bg=self.g.header_color,
+                          font=(self.g.header_font, self.g.header_size))
+        self.summary_label.config(bg=self.g.bg_color,
+                                  font=(self.g.points_font, self.g.task_font_size))
+        self.histogram_text.config(bg=self.g.bg_color,
+                                   font=("Courier", self.g.test_result_size))
+
+
+class PreviewApp(tk.Frame):
+    def __init__(self, master, g: Graphics):
+        """
+        Tab showing the feedback of the current team exactly as it is uploaded to StudOn.
+        """
+        super().__init__(master=master)
+        self.g = g
+
+        self.title = tk.Label(self,
+                              text="Vorschau",
+                              relief="solid")
+        self.title.pack(fill="x", side="top")
+        self.info_frame = tk.Frame(self)
+        self.info_label = tk.Label(self.info_frame, text="Keine Korrektur geöffnet", anchor="w")
+        self.info_label.pack(fill="x", side="left", expand=True)
+        self.copy_button = tk.Button(self.info_frame, text="Kopieren", command=self.copy_to_clipboard)
+        self.copy_button.pack(side="right")
+        self.info_frame.pack(fill="x", side="top", padx=10, pady=5)
+
+        self.text_frame = tk.Frame(self)
+        self.text = tk.Text(self.text_frame, wrap="word", relief="flat")
+        text_scroll = ttk.Scrollbar(self.text_frame, orient=tk.VERTICAL, command=self.text.yview)
+        self.text.configure(yscrollcommand=text_scroll.set, state="disabled")
+        text_scroll.pack(side="right", fill="y")
+        self.text.pack(fill="both", expand=True)
+        self.text_frame.pack(fill="both", expand=True, padx=10, pady=5)
+
+        self.update_labels_graphics()
+
+    def update_preview(self, team_id=None, feedback: tuple = None):
+        """
+        Show the feedback of a team.
+
+        :param team_id: ID of the team, None => Clear the tab
+        :param feedback: (total points, feedback) as returned by Manager.get_feedback
+        """
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        if team_id is None:
+            self.info_label.configure(text="Keine Korrektur geöffnet")
+        else:
+            self.info_label.configure(text=f"Team {team_id}: {feedback[0]} Punkte")
+            self.text.insert("1.0", feedback[1])
+        self.text.configure(state="disabled")
+
+    def copy_to_clipboard(self):
+        self.clipboard_clear()
+        self.clipboard_append(self.text.get("1.0", "end-1c"))
+        self.update()
+
+    def update_labels_graphics(self):
+        self.config(bg=self.g.bg_color)
+        self.info_frame.config(bg=self.g.bg_color)
+        self.text_frame.config(bg=self.g.bg_color)
+        self.title.config(bg=self.g.header_color,
+                          font=(self.g.header_font, self.g.header_size))
+        self.info_label.config(bg=self.g.bg_color,
+                               font=(self.g.points_font, self.g.task_font_size))
+        self.copy_button.config(bg=self.g.button_color,
+                                font=(self.g.points_font, self.g.button_font_size))
+        self.text.config(bg=self.g.bg_color,
+                         font=(self.g.test_result_font, self.g.test_result_size))
@@ -1,9 +1,121 @@
 import os
 import datetime
+import filecmp
+import json
+import logging
 import shutil
+import struct
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox
 
 
+class ImportCancelled(Exception):
+    """
+    Raised inside an import when the user cancelled it.
+    """
+    pass
+
+
+class ExportCancelled(Exception):
+    """
+    Raised inside an export when the user cancelled it.
+    """
+    pass
+
+
+def atomic_write_json(path: str, data):
+    """
+    Writes data as JSON file via a temporary file which replaces the target at the end, so the file is either
+    completely old or completely new (even if the application crashes while writing).
+
+    :param path: Path to the JSON file
+    :param data: JSON serializable data
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AutoSaver:
+    def __init__(self, save_func, delay: float = 2.0):
+        """
+        Calls save_func on a background thread. All changes scheduled within delay seconds are saved together.
+
+        :param save_func: Function saving all changes, must be thread-safe
+        :param delay: Seconds between the first change and the save
+        """
+        self.save_func = save_func
+        self.delay = delay
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        """
+        Saves after the delay unless a save is already scheduled.
+        """
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.save_func()
+        except Exception:
+            logging.exception("io_utils.py: Autosave failed")
+
+    def cancel(self):
+        """
+        Cancels a scheduled save.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def flush(self):
+        """
+        Saves immediately on the calling thread (e.g. before closing).
+        """
+        self.cancel()
+        self.save_func()
+
+
+def check_cancel(cancel):
+    """
+    :param cancel: threading.Event set by the GUI to cancel the running import (or None)
+    """
+    if cancel is not None and cancel.is_set():
+        raise ImportCancelled()
+
+
+def track_copy(copy_function, progress=None, cancel=None):
+    """
+    Wraps a copy function for shutil.copytree to report every copied file and to stop on cancellation.
+    """
+    copied = [0]
+
+    def copy(src: str, dst: str):
+        check_cancel(cancel)
+        res = copy_function(src, dst)
+        copied[0] += 1
+        if progress is not None:
+            progress(f"Dateien kopiert: {copied[0]}", copied[0], 0)
+        return res
+
+    return copy
+
+
 def extract_zip_to_tmp(path_to_tmp: str, zip_path: str):
     if os.path.isfile(zip_path) and zip_path.endswith(".zip"):
         src = zip_path
@@ -14,10 +126,68 @@ def extract_zip_to_tmp(path_to_tmp: str, zip_path: str):
     return dst
 
 
-def copy_import_src(path_to_tmp: str, chosen_path: str, path_to_data: str):
+def link_or_copy(src: str, dst: str):
+    """
+    Copy function for shutil.copytree which creates hard links instead of copies.
+    Falls back to copying if linking is not possible (e.g. across devices).
+    Korrektur.pdf is always copied, since it is edited in place and must not change the import source.
+    """
+    if os.path.basename(src) != "Korrektur.pdf":
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
+def find_content_src(search_dir: str):
+    """
+    :param search_dir: Folder to search in
+    :return: First folder containing both a "Code" and a "Korrektur" folder or "" if there is none
+    """
+    for dirpath, dirnames, _ in os.walk(search_dir):
+        code = [i for i in dirnames if "Code" in i]
+        pdf = [i for i in dirnames if "Korrektur" in i]
+
+        if len(code) > 0 and len(pdf) > 0:
+            return dirpath
+    return ""
+
+
+def read_folder_team_ids(folder: str):
+    """
+    Reads "tutors_team_ids.json" from an import folder.
+
+    :param folder: Folder selected for the import
+    :return: Parsed JSON content or None if the file does not exist
+    """
+    content_src = find_content_src(folder)
+    if not content_src or not os.path.isfile(os.path.join(content_src, "tutors_team_ids.json")):
+        return None
+    with open(os.path.join(content_src, "tutors_team_ids.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def copy_import_src(path_to_tmp: str, chosen_path: str, content_dst: str, merge: bool,
+                    progress=None, cancel=None):
+    """
+    Copies the content of an import folder (or a fully extracted zip archive) to content_dst.
+
+    :param path_to_tmp: Path to the .cache folder
+    :param chosen_path: Folder or zip archive selected for the import
+    :param content_dst: Destination folder, see get_content_dst
+    :param merge: True if the new submissions are merged into the existing content_dst
+    :param progress: Optional callback progress(text, done, total)
+    :param cancel: Optional threading.Event to cancel the copy (raises ImportCancelled)
+    :return: Tuple (content_dst, set of IDs of already graded teams whose submission changed or None if nothing
+             was merged) or None if the import source is not valid
+    """
     search_dir = ""
+    extracted = False
     if os.path.isfile(chosen_path) and chosen_path.endswith(".zip"):
         search_dir = extract_zip_to_tmp(path_to_tmp, chosen_path)
+        extracted = True
     elif os.path.isdir(chosen_path):
         search_dir = chosen_path
     else:
@@ -26,32 +196,314 @@ def copy_import_src(path_to_tmp: str, chosen_path: str, path_to_data: str):
     if not search_dir:
         return
 
-    content_src = ""
-    for dirpath, dirnames, _ in os.walk(search_dir):
-        code = [i for i in dirnames if "Code" in i]
-        pdf = [i for i in dirnames if "Korrektur" in i]
+    content_src = find_content_src(search_dir)
+    if not content_src:
+        clear_tmp(path_to_tmp)
+        return None
 
-        if len(code) > 0 and len(pdf) > 0:
-            content_src = dirpath
-            break
-
-    name = str(datetime.date.today()) + "_" + os.path.splitext(os.path.split(chosen_path)[-1])[0]
-    content_dst = os.path.join(path_to_data, name)
-
-    if os.path.isdir(content_dst):
-        replace = messagebox.askokcancel(title="AuD-GUI :D - Warnung!",
-                                         message=f"Ordner \"{content_dst}\" existiert bereits.\n"
-                                                 f"Trotzdem fortfahren und den bisherigen Ordner überschreiben?")
-        if replace:
-            # no permission to replace existing folder => terminate
-            shutil.rmtree(content_dst)
+    if merge:
+        changed_teams = merge_import_tree(content_src, content_dst, progress, cancel)
+        clear_tmp(path_to_tmp)
+        return content_dst, changed_teams
+
+    if extracted:
+        # Extracted tree is temporary anyway => move it into place (plain rename on the same device)
+        shutil.move(src=content_src, dst=content_dst)
+    else:
+        # Keep the import source untouched, but share the file contents where possible
+        shutil.copytree(src=content_src, dst=content_dst,
+                        copy_function=track_copy(link_or_copy, progress, cancel))
+
+    clear_tmp(path_to_tmp)
+    return content_dst, None
+
+
+def merge_import_tree(content_src: str, content_dst: str, progress=None, cancel=None):
+    """
+    Merges a new import folder into an existing import. Unchanged files are skipped and the Korrektur folders
+    of already graded teams (state.json, Korrektur.pdf) are never touched.
+
+    :return: Set of IDs of already graded teams whose submission changed
+    """
+    pdf_dirs = [d for d, is_dir in scan_dir(content_src).items() if "Korrektur" in d and is_dir]
+    graded = set()
+    for d in pdf_dirs:
+        graded |= get_graded_teams(os.path.join(content_dst, d, "Abgaben"))
+    changed_teams = set()
+
+    def merge_file(src: str, dst: str):
+        rel_path = os.path.relpath(src, content_src).replace(os.sep, "/")
+        team_id = get_team_id(rel_path)
+        if team_id in graded and "Korrektur" in rel_path.split("/")[0]:
+            return dst
+        if os.path.isfile(dst):
+            if filecmp.cmp(src, dst, shallow=False):
+                return dst
+            os.remove(dst)  # Never write through an existing hard link
+        if team_id in graded:
+            changed_teams.add(team_id)
+        return link_or_copy(src, dst)
+
+    shutil.copytree(src=content_src, dst=content_dst, copy_function=track_copy(merge_file, progress, cancel),
+                    dirs_exist_ok=True)
+    return changed_teams
+
+
+def snapshot_tree(path: str):
+    """
+    Hard link copy of an import folder, taken before new submissions are merged into it (see restore_tree).
+    Sufficient since the import never writes through existing files, they are removed and written anew.
+
+    :return: Path of the snapshot (next to path)
+    """
+    snapshot = path + ".merge_backup"
+    if os.path.isdir(snapshot):
+        shutil.rmtree(snapshot)
+
+    def link(src: str, dst: str):
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            return shutil.copy2(src, dst)
+
+    shutil.copytree(src=path, dst=snapshot, copy_function=link)
+    return snapshot
+
+
+def restore_tree(snapshot: str, path: str):
+    """
+    Rolls an import folder back to a snapshot (see snapshot_tree) and removes the snapshot. Files that were not
+    replaced in the meantime are kept as they are (e.g. an open session.db).
+    """
+    # Remove everything that was added or replaced since the snapshot
+    for dirpath, dirnames, filenames in os.walk(path):
+        snapshot_dir = os.path.join(snapshot, os.path.relpath(dirpath, path))
+        for d in dirnames[:]:
+            if not os.path.isdir(os.path.join(snapshot_dir, d)):
+                shutil.rmtree(os.path.join(dirpath, d))
+                dirnames.remove(d)
+        for f in filenames:
+            snapshot_file = os.path.join(snapshot_dir, f)
+            if not os.path.isfile(snapshot_file) or not os.path.samefile(snapshot_file, os.path.join(dirpath, f)):
+                os.remove(os.path.join(dirpath, f))
+
+    # Bring back everything that was removed or replaced
+    def restore(src: str, dst: str):
+        if os.path.exists(dst):
+            return dst
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            return shutil.copy2(src, dst)
+
+    shutil.copytree(src=snapshot, dst=path, copy_function=restore, dirs_exist_ok=True)
+    shutil.rmtree(snapshot)
+
+
+def get_content_dst(chosen_path: str, path_to_data: str):
+    """
+    Builds the data folder name for an import source. If the same source was imported before (on any day),
+    the user can merge the new submissions into that folder, replace it or abort.
+
+    :param chosen_path: Folder or zip archive selected for the import
+    :param path_to_data: Path to the data folder
+    :return: Tuple (destination folder, True if new submissions are merged into an existing import)
+             or None if the user aborted
+    """
+    source_name = os.path.splitext(os.path.split(chosen_path)[-1])[0]
+    content_dst = os.path.join(path_to_data, str(datetime.date.today()) + "_" + source_name)
+
+    # Previous imports of the same source, newest first ("<YYYY-MM-DD>_<source name>")
+    previous = sorted([d for d in os.listdir(path_to_data)
+                       if d[11:] == source_name and os.path.isdir(os.path.join(path_to_data, d))], reverse=True)
+    if len(previous) > 0:
+        existing = os.path.join(path_to_data, previous[0])
+        if existing == content_dst:
+            replace_info = "Nein: Bisherigen Ordner überschreiben (Korrektur geht verloren)"
         else:
+            replace_info = f"Nein: Neu nach \"{content_dst}\" importieren"
+        merge = messagebox.askyesnocancel(title="AuD-GUI :D - Warnung!",
+                                          message=f"Ordner \"{existing}\" existiert bereits.\n\n"
+                                                  f"Ja: Neue und geänderte Abgaben übernehmen "
+                                                  f"(bisherige Korrektur bleibt erhalten)\n"
+                                                  f"{replace_info}\n"
+                                                  f"Abbrechen: Import abbrechen")
+        if merge is None:
             return None
+        elif merge:
+            return existing, True
 
-    shutil.copytree(src=content_src, dst=content_dst)
+    # Permission to replace an existing folder was given above, it is moved aside by the import (see Manager)
+    return content_dst, False
 
-    clear_tmp(path_to_tmp)
-    return content_dst
+
+def get_graded_teams(abgaben_dir: str):
+    """
+    :param abgaben_dir: "Abgaben" directory of the Korrektur folder of a session
+    :return: Set of team IDs which already have a state.json
+    """
+    if not os.path.isdir(abgaben_dir):
+        return set()
+    return {name[len("Team "):] for name, is_dir in scan_dir(abgaben_dir).items()
+            if is_dir and name.startswith("Team ") and os.path.isfile(os.path.join(abgaben_dir, name, "state.json"))}
+
+
+def get_team_folders(abgaben_dir: str):
+    """
+    Maps the team IDs to their folders with a single directory scan. Team folders are named "Team <id>" (import) or
+    "Team_<id>" (StudOn export), the ID has to match exactly.
+
+    :param abgaben_dir: "Abgaben" directory of the Korrektur folder of a session
+    :return: Dict team id (str) -> folder name
+    """
+    if not os.path.isdir(abgaben_dir):
+        return {}
+    folders = {}
+    for name, is_dir in scan_dir(abgaben_dir).items():
+        if is_dir and name.startswith(("Team ", "Team_")):
+            folders.setdefault(name[len("Team "):], name)
+    return folders
+
+
+def get_team_id(rel_path: str):
+    """
+    :param rel_path: Path relative to the content root (separated by "/")
+    :return: ID of the team folder ("Team <id>") the path belongs to or None
+    """
+    for part in rel_path.split("/"):
+        if part.startswith("Team "):
+            return part[len("Team "):]
+    return None
+
+
+def file_crc32(path: str):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def find_zip_content_root(zf: zipfile.ZipFile):
+    """
+    Searches the central directory of the archive for the folder containing the "Code" and "Korrektur" folders.
+
+    :param zf: Opened zip archive
+    :return: Tuple (root prefix, code folder, pdf folder) or None if the structure was not found
+    """
+    # Collect the children of every folder in the archive
+    children = {}
+    for name in zf.namelist():
+        parts = name.split("/")[:-1]  # Folders only ("a/b/c.txt" and "a/b/" -> ["a", "b"])
+        for depth in range(len(parts)):
+            prefix = "".join(p + "/" for p in parts[:depth])
+            children.setdefault(prefix, set()).add(parts[depth])
+
+    # Shallowest folder wins, like the first hit of os.walk
+    for prefix in sorted(children.keys(), key=lambda x: (x.count("/"), x)):
+        sub_dirs = children.get(prefix, set())
+        code = sorted(i for i in sub_dirs if "Code" in i and prefix + i + "/" in children)
+        pdf = sorted(i for i in sub_dirs if "Korrektur" in i and prefix + i + "/" in children)
+        if len(code) > 0 and len(pdf) > 0:
+            return prefix, code[0], pdf[0]
+    return None
+
+
+def read_zip_team_ids(zip_path: str):
+    """
+    Reads "tutors_team_ids.json" from a StudOn archive without extracting anything.
+
+    :param zip_path: Path to the zip archive
+    :return: Parsed JSON content or None if the file does not exist
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        content = find_zip_content_root(zf)
+        if content is None:
+            return None
+        try:
+            with zf.open(content[0] + "tutors_team_ids.json") as f:
+                return json.load(f)
+        except KeyError:
+            return None
+
+
+def extract_zip_teams(zip_path: str, content_dst: str, merge: bool, team_ids: list, progress=None, cancel=None):
+    """
+    Extracts only the selected team folders, status.csv and tutors_team_ids.json from a StudOn archive
+    directly into the data folder. All other members are never read.
+
+    :param zip_path: Path to the zip archive
+    :param content_dst: Destination folder, see get_content_dst
+    :param merge: True if the new submissions are merged into the existing content_dst
+    :param team_ids: IDs of the teams to extract
+    :param progress: Optional callback progress(text, done, total) reporting the extracted bytes
+    :param cancel: Optional threading.Event to cancel the extraction (raises ImportCancelled)
+    :return: Tuple (path to the extracted content, set of IDs of already graded teams whose submission changed
+             or None if nothing was merged) or None if the import is not possible
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        content = find_zip_content_root(zf)
+        if content is None:
+            return None
+        root, code, pdf = content
+
+        # Members to keep (relative to root)
+        team_prefixes = tuple(f"{d}/Abgaben/Team {t}/" for d in (code, pdf) for t in team_ids)
+        single_files = {"tutors_team_ids.json", f"{pdf}/Abgaben/status.csv"}
+
+        os.makedirs(os.path.join(content_dst, code, "Abgaben"), exist_ok=merge)
+        os.makedirs(os.path.join(content_dst, pdf, "Abgaben"), exist_ok=merge)
+        # Korrektur folders of graded teams are never touched while merging
+        graded = get_graded_teams(os.path.join(content_dst, pdf, "Abgaben")) if merge else set()
+        changed_teams = set()
+
+        members = []
+        for info in zf.infolist():
+            if not info.filename.startswith(root) or info.is_dir():
+                continue
+            rel_name = info.filename[len(root):]
+            if rel_name in single_files or rel_name.startswith(team_prefixes):
+                members.append((rel_name, info))
+        total_bytes = sum(info.file_size for _, info in members)
+        done_bytes = 0
+
+        for rel_name, info in members:
+            check_cancel(cancel)
+            done_bytes += info.file_size
+            if progress is not None:
+                progress(f"Entpackt: {done_bytes // 1024 ** 2} / {total_bytes // 1024 ** 2} MB", done_bytes, total_bytes)
+            # Never write outside of the destination folder
+            target = os.path.normpath(os.path.join(content_dst, *rel_name.split("/")))
+            if not target.startswith(os.path.normpath(content_dst) + os.sep):
+                continue
+            team_id = get_team_id(rel_name)
+            if merge:
+                if team_id in graded and rel_name.startswith(pdf + "/"):
+                    continue
+                if os.path.isfile(target) and os.path.getsize(target) == info.file_size \
+                        and file_crc32(target) == info.CRC:
+                    continue
+                if os.path.isfile(target):
+                    os.remove(target)  # Never write through an existing hard link
+                if team_id in graded:
+                    changed_teams.add(team_id)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zf.open(info) as src, open(target, "wb") as dst_file:
+                shutil.copyfileobj(src, dst_file, 1024 * 1024)
+    return content_dst, changed_teams if merge else None
+
+
+def scan_dir(path: str):
+    """
+    Lists a directory with a single os.scandir call.
+
+    :param path: Directory to scan
+    :return: Dict mapping every entry name to True if it is a directory, False otherwise
+    """
+    with os.scandir(path) as it:
+        return {entry.name: entry.is_dir() for entry in it}
 
 
 def clear_tmp(path_to_tmp: str):
@@ -61,7 +513,190 @@ def clear_tmp(path_to_tmp: str):
                 shutil.rmtree(os.path.join(path_to_tmp, d))
 
 
+def _zip_dir_entry(zf: zipfile.ZipFile, name: str):
+    """
+    Adds an (empty) directory entry to a zip file.
+    """
+    info = zipfile.ZipInfo(name.rstrip("/") + "/", date_time=datetime.datetime.now().timetuple()[:6])
+    info.external_attr = (0o40775 << 16) | 0x10  # Directory flag for Unix and MS-DOS
+    zf.writestr(info, b"")
+
+
+# Compression of the export entries: (Korrektur.pdf, status.csv). PDFs are compressed already and gain almost nothing.
+EXPORT_COMPRESSION = {"auto": (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED),
+                      "deflate": (zipfile.ZIP_DEFLATED, zipfile.ZIP_DEFLATED),
+                      "store": (zipfile.ZIP_STORED, zipfile.ZIP_STORED)}
+
+
+def _read_ahead(paths: list, workers: int):
+    """
+    Reads files on a thread pool while the previous ones are processed, at most 2 * workers files are in memory.
+
+    :param paths: File paths (None entries are yielded as None)
+    :return: Generator of the file contents in the order of paths, the OSError for files that could not be read
+    """
+    def read(path):
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(read, path))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _export_pdf_entries(zip_path: str):
+    """
+    :return: Dict team id -> ZipInfo of Korrektur.pdf in a previous export zip file (empty if there is none)
+    """
+    entries = {}
+    if zip_path is None or not os.path.isfile(zip_path):
+        return entries
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            for info in zf.infolist():
+                # <folder name>/Team_<id>/Korrekturen/Korrektur.pdf
+                parts = info.filename.split("/")
+                if len(parts) == 4 and parts[1].startswith("Team_") and parts[2:] == ["Korrekturen", "Korrektur.pdf"]:
+                    entries[parts[1][len("Team_"):]] = info
+    except (OSError, zipfile.BadZipFile):
+        logging.warning(f"io_utils.py: Previous export \"{zip_path}\" can not be read")
+        return {}
+    return entries
+
+
+def _copy_zip_entry(zf: zipfile.ZipFile, src, src_info: zipfile.ZipInfo, arcname: str):
+    """
+    Copies an entry of another zip file as it is, without decompressing and compressing it again. zipfile has no
+    API for this, the entry is written like ZipFile.writestr does (local header and data, central directory on close).
+
+    :param zf: Zip file opened for writing
+    :param src: Other zip file, opened as binary file
+    :param src_info: ZipInfo of the entry in the other zip file
+    :param arcname: Name of the entry in zf
+    """
+    # The compressed data follows the local header (fixed part, file name and extra field)
+    src.seek(src_info.header_offset)
+    header = src.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header of \"{src_info.filename}\"")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    src.seek(name_length + extra_length, os.SEEK_CUR)
+
+    info = zipfile.ZipInfo(arcname, date_time=src_info.date_time)
+    info.external_attr = src_info.external_attr
+    info.compress_type = src_info.compress_type
+    info.CRC = src_info.CRC
+    info.compress_size = src_info.compress_size
+    info.file_size = src_info.file_size
+    info.header_offset = zf.fp.tell()
+    zf.fp.write(info.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data of \"{src_info.filename}\"")
+        zf.fp.write(chunk)
+        remaining -= len(chunk)
+    zf.start_dir = zf.fp.tell()
+    zf.filelist.append(info)
+    zf.NameToInfo[arcname] = info
+
+
+def write_export_zip(zip_path: str, folder_name: str, teams: list, status_csv: str, compression: str = "auto",
+                     workers: int = 4, progress=None, cancel=None, previous_zip: str = None, reuse: set = None,
+                     errors: list = None):
+    """
+    Writes the StudOn export (status.csv and <folder_name>/Team_<id>/Korrekturen/Korrektur.pdf) straight from the
+    source files into a zip file, no export folder is created. The zip file is written to a temporary file which
+    replaces zip_path at the end.
+
+    :param zip_path: Path to the zip file
+    :param folder_name: Name of the folder in the zip file (given by StudOn)
+    :param teams: List of (team id, path to Korrektur.pdf or None)
+    :param status_csv: Content of the updated status.csv
+    :param compression: Key of EXPORT_COMPRESSION
+    :param workers: Number of threads reading the PDFs ahead of the zip writer, 0 => Read while writing
+    :param progress: Optional callback progress(text, done, total), called after every team
+    :param cancel: Optional threading.Event, raises ExportCancelled (the temporary file is removed)
+    :param previous_zip: Zip file of the previous export (may be zip_path itself)
+    :param reuse: IDs of the teams which did not change since previous_zip, their Korrektur.pdf is copied from there
+    :param errors: Optional list to which a message for every Korrektur.pdf that could not be read is appended, these
+                   teams are exported without it
+    :return: Number of teams copied from previous_zip
+    """
+    pdf_type, csv_type = EXPORT_COMPRESSION.get(compression, EXPORT_COMPRESSION["auto"])
+    previous_entries = _export_pdf_entries(previous_zip) if reuse else {}
+    # Entries are copied as they are => Only if they were written with the same compression
+    reused = {team_id for team_id, pdf_path in teams
+              if pdf_path is not None and team_id in reuse and team_id in previous_entries
+              and previous_entries[team_id].compress_type == pdf_type} if reuse else set()
+    # Only PDFs that are not copied from the previous export are read from the disk
+    pdf_paths = [None if team_id in reused else pdf_path for team_id, pdf_path in teams]
+    if workers > 0:
+        contents = _read_ahead(pdf_paths, workers)
+    else:
+        contents = (None for _ in pdf_paths)
+    tmp_path = zip_path + ".tmp"
+    previous = open(previous_zip, "rb") if reused else None
+    try:
+        with zipfile.ZipFile(tmp_path, "w") as zf:
+            _zip_dir_entry(zf, folder_name)
+            zf.writestr("status.csv", status_csv, compress_type=csv_type)
+            written = 0  # Bytes of the PDFs
+            for i, ((team_id, pdf_path), content) in enumerate(zip(teams, contents)):
+                if cancel is not None and cancel.is_set():
+                    raise ExportCancelled()
+                team_dir = f"{folder_name}/Team_{team_id}"
+                _zip_dir_entry(zf, team_dir)
+                _zip_dir_entry(zf, f"{team_dir}/Korrekturen")
+                if pdf_path is not None:
+                    arcname = f"{team_dir}/Korrekturen/Korrektur.pdf"
+                    try:
+                        if team_id in reused:
+                            # Unchanged team, the compressed entry is copied forward
+                            _copy_zip_entry(zf, previous, previous_entries[team_id], arcname)
+                        elif isinstance(content, OSError):
+                            raise content
+                        elif content is None:
+                            zf.write(pdf_path, arcname=arcname, compress_type=pdf_type)
+                        else:
+                            info = zipfile.ZipInfo.from_file(pdf_path, arcname=arcname)
+                            info.compress_type = pdf_type
+                            zf.writestr(info, content)
+                        written += zf.getinfo(arcname).file_size
+                    except OSError as e:
+                        # A single missing PDF does not stop the export
+                        logging.error(f"io_utils.py: Korrektur.pdf of team {team_id} not exported: {e}")
+                        if errors is not None:
+                            errors.append(f"\"Korrektur.pdf\" von Team {team_id} konnte nicht gelesen werden und "
+                                          f"fehlt im Export!")
+                if progress is not None:
+                    progress(f"Zip-Datei schreiben ({i + 1}/{len(teams)} Teams, {written / 1e6:.1f} MB)", i + 1,
+                             len(teams))
+        if previous is not None:
+            # The previous export may be replaced by the new one
+            previous.close()
+        os.replace(tmp_path, zip_path)
+    finally:
+        # Stops the reading threads if the writing failed
+        contents.close()
+        if previous is not None:
+            previous.close()
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+    return len(reused)
+
+
 # Function to check number of updates
 def check_updates(dataframe, id_list):
-    updates = [entry for entry in dataframe["update"] if entry == 1]
-    return len(updates) == len(id_list)
+    return int((dataframe["update"] == 1).sum()) == len(id_list)
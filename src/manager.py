@@ -7,12 +7,35 @@ import subprocess
 import platform
 import pandas as pd
 import csv
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tkinter import filedialog
 from tkinter import messagebox
 
-from src.comment_utils import State, Settings
+from src.comment_utils import State, Settings, StatusIndex, StateError, Journal, ValidationReport
+from src.stats_utils import PointsMatrix
+from src.session_store import SessionStore
 from src.graphics import Graphics
-from src.io_utils import check_updates, copy_import_src
+from src.io_utils import check_updates, copy_import_src, extract_zip_teams, read_zip_team_ids, scan_dir, \
+    get_graded_teams, get_content_dst, read_folder_team_ids, check_cancel, clear_tmp, ImportCancelled, \
+    atomic_write_json, AutoSaver, write_export_zip, get_team_folders, ExportCancelled, snapshot_tree, restore_tree
+
+# Session manifest, stored in the directory of an imported correction
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+# Hashes of the teams in the last export, stored next to the exported zip files
+EXPORT_CACHE_FILE = "export_cache.json"
+# Number of opened teams whose full state is kept in memory
+MAX_LOADED_STATES = 32
+# Journal of grading changes since the last save
+JOURNAL_FILE = "journal.jsonl"
+# Seconds between the first change and the autosave
+AUTOSAVE_DELAY = 2.0
 
 
 class Manager:
@@ -31,6 +54,17 @@ class Manager:
         self.pdf_dir = ""
         self.path_to_status_csv = ""
         self.dir_name = ""
+        self.session_dir = ""
+        # Recently opened states (id -> state), least recently opened first
+        self.loaded_states = OrderedDict()
+        # Grading changes since the last save
+        self.journal = Journal()
+        # Optional SQLite store of the states (None => state.json files and manifest)
+        self.store = None
+        # Changes are saved on a background thread, the lock protects the states while they are copied
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+        self.autosave = AutoSaver(self.save, delay=AUTOSAVE_DELAY)
 
         # Settings
         if "settings.json" in os.listdir(self.path_to_settings):
@@ -61,139 +95,395 @@ class Manager:
         self.team_state: State = None
         self.team_list: list = []  # List of all team ids (or names?)
         self.states: List[State] = []  # List of all team states (State objects)
+        self.points_matrix: PointsMatrix = None  # Points of all teams, created by get_points_matrix
 
-    def import_data(self, res):
-        logging.debug("manager.py: import_data")
+    def prepare_import(self, res):
+        """
+        First part of the import, runs on the GUI thread: Checks the result of the ImportDialog, reads the team IDs
+        and asks where to import to. Nothing is copied yet.
+
+        :param res: Result of the ImportDialog ([path, template] or [path, template, team_ids])
+        :return: Dict describing the import (input of import_data) or None if the import is not possible
+        """
+        logging.debug("manager.py: prepare_import")
+        if len(res) not in (2, 3):
+            logging.error("prepare_import: Invalid return value of ImportDialog. Expected 2 or 3 return values.")
+            return None
         filename, template = res[0], res[1]
 
-        # copy_import_src(self.path_to_tmp, filename, self.path_to_data)
-        # return
+        is_zip = os.path.isfile(filename) and filename.endswith(".zip")
+        if not is_zip and not os.path.isdir(filename):
+            logging.debug("prepare_import: Import folder is not valid or does not exist")
+            messagebox.showerror(title="AuD-GUI :D - Fehler!",
+                                 message=f"\"{filename}\" ist weder ein Ordner noch ein Zip-Archiv!")
+            return None
 
-        # dir_name = copy_import_data(filename, self.path_to_data)
-        dir_name = copy_import_src(self.path_to_tmp, filename, self.path_to_data)
-        if dir_name is None:
-            logging.debug("import_data: Import folder is not valid or does not exist")
-            return
+        template_files = [t for t in os.listdir(self.path_to_templates) if template and template in t]
+        if len(template_files) == 0:
+            logging.error(f"prepare_import: Template \"{template}\" not found")
+            messagebox.showerror(title="AuD-GUI :D - Fehler!", message="Kein gültiges Template ausgewählt!")
+            return None
+        logging.debug(f"prepare_import: Using template \"{template}\" ({template_files[0]})")
 
-        if len(res) == 2:
-            # Automatic IDs
-            if "tutors_team_ids.json" not in os.listdir(os.path.join(self.path, dir_name)):
-                logging.error("import_data: No \"tutors_team_ids.json\" found for automatic id selection!")
-                messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                     message=f"Datei \"tutors_team_ids.json\" für die automatische ID-Auswahl wurde "
-                                             f"nicht in \"{os.path.join(self.path, dir_name)}\" gefunden! "
-                                             f"Manuelle Eingabe der IDs erforderlich.")
-                # Abort and delete folder
-                logging.debug(f"import_data: Remove folder \"{os.path.join(self.path, dir_name)}\"")
-                shutil.rmtree(os.path.join(self.path, dir_name))
-                return
-            else:
-                # Open "tutors_team_ids.json"
-                with open(os.path.join(self.path, dir_name, "tutors_team_ids.json"), "r", encoding="utf-8") as f:
-                    json_ids = json.load(f)
-
-                data_list = json_ids[self.settings.id_key]
-                team_ids = []
-                compile_errors = []
-                plagiats = []
-
-                # Read out data
-                for item in data_list:
-                    team_ids.append(str(item[0]))
-                    # A bit of security :D
-                    if len(item) > 1:
-                        compile_errors.append(item[1])
-                    else:
-                        compile_errors.append(False)
-                    if len(item) > 2:
-                        plagiats.append(item[2])
-                    else:
-                        plagiats.append(False)
-        elif len(res) == 3:
+        if len(res) == 3:
             # Manual IDs
             team_ids = res[2]
             compile_errors = [False for _ in range(len(team_ids))]
             plagiats = [False for _ in range(len(team_ids))]
         else:
-            logging.error("import_data: Invalid return value of ImportDialog. Expected 2 or 3 return values.")
-            return
-
-        self.team_list = team_ids
-        self.dir_name = os.path.split(dir_name)[-1]  # Store for later usage
+            # Automatic IDs (read without extracting or copying anything)
+            json_ids = read_zip_team_ids(filename) if is_zip else read_folder_team_ids(filename)
+            if json_ids is None:
+                logging.error("prepare_import: No \"tutors_team_ids.json\" found for automatic id selection!")
+                messagebox.showerror(title="AuD-GUI :D - Fehler!",
+                                     message=f"Datei \"tutors_team_ids.json\" für die automatische ID-Auswahl "
+                                             f"wurde nicht in \"{filename}\" gefunden! "
+                                             f"Manuelle Eingabe der IDs erforderlich.")
+                return None
+            try:
+                team_ids, compile_errors, plagiats = self._parse_team_ids(json_ids)
+            except KeyError:
+                logging.error(f"prepare_import: ID key \"{self.settings.id_key}\" not in \"tutors_team_ids.json\"")
+                messagebox.showerror(title="AuD-GUI :D - Fehler!",
+                                     message=f"Key \"{self.settings.id_key}\" nicht in \"tutors_team_ids.json\" "
+                                             f"gefunden! Manuelle Eingabe der IDs erforderlich.")
+                return None
+
+        dst = get_content_dst(filename, self.path_to_data)
+        if dst is None:
+            logging.debug("prepare_import: Aborted by user")
+            return None
+        content_dst, merge = dst
+
+        return {"source": filename,
+                "zip": is_zip,
+                "template_file": os.path.join(self.path_to_templates, template_files[0]),
+                "team_ids": team_ids,
+                "compile_errors": compile_errors,
+                "plagiats": plagiats,
+                "content_dst": content_dst,
+                "merge": merge}
+
+    def import_data(self, plan: dict, progress=None, cancel=None):
+        """
+        Second part of the import, may run on a worker thread since it does not open any dialogs:
+        Extracts or copies the submissions, removes unnecessary files and creates the states.
+        The manager is only updated at the very end. If the import is cancelled or fails, a new import folder is
+        removed and a merged import folder is rolled back to a snapshot taken before the merge, so the manager and
+        its folder stay untouched. A folder that is replaced is moved aside and only removed after the import worked.
+
+        :param plan: Result of prepare_import
+        :param progress: Optional callback progress(text, done, total), total is 0 if unknown
+        :param cancel: Optional threading.Event, raises ImportCancelled after rolling back
+        :return: List of error messages (empty if everything worked)
+        """
+        logging.debug("manager.py: import_data")
+        snapshot = None
+        replaced = None
+        if plan["merge"]:
+            # The existing import is changed in place
+            if progress is not None:
+                progress("Bisherige Korrektur sichern", 0, 0)
+            snapshot = snapshot_tree(plan["content_dst"])
+        elif os.path.isdir(plan["content_dst"]):
+            # The existing import is replaced, keep it until the new one is complete
+            replaced = plan["content_dst"] + ".replace_backup"
+            if os.path.isdir(replaced):
+                shutil.rmtree(replaced)
+            os.rename(plan["content_dst"], replaced)
+        try:
+            errors = self._import_data(plan, progress, cancel)
+        except Exception as e:
+            if isinstance(e, ImportCancelled):
+                logging.debug("import_data: Cancelled by user")
+            else:
+                logging.error(f"import_data: Import failed, rolling back: {e}")
+            # Roll back: Remove new import folder or restore the merged one
+            if snapshot is not None:
+                restore_tree(snapshot, plan["content_dst"])
+            else:
+                if os.path.isdir(plan["content_dst"]):
+                    shutil.rmtree(plan["content_dst"])
+                if replaced is not None:
+                    os.rename(replaced, plan["content_dst"])
+            clear_tmp(self.path_to_tmp)
+            raise
+        if snapshot is not None:
+            shutil.rmtree(snapshot)
+        if replaced is not None:
+            shutil.rmtree(replaced)
+        return errors
+
+    def _import_data(self, plan: dict, progress, cancel):
+        team_ids = plan["team_ids"]
+        compile_errors = plan["compile_errors"]
+        plagiats = plan["plagiats"]
+
+        # Merging works on the state.json files => Write them if the existing import uses a session store
+        if plan["merge"] and SessionStore.exists(plan["content_dst"]):
+            existing_store = SessionStore(plan["content_dst"])
+            existing_store.write_json_files()
+            existing_store.close()
+
+        if plan["zip"]:
+            # Zip archive: extract only the selected teams
+            imported = extract_zip_teams(plan["source"], plan["content_dst"], plan["merge"], team_ids,
+                                         progress, cancel)
+        else:
+            imported = copy_import_src(self.path_to_tmp, plan["source"], plan["content_dst"], plan["merge"],
+                                       progress, cancel)
+        if imported is None:
+            logging.debug("import_data: Import source is not valid")
+            return [f"\"{plan['source']}\" enthält keine Abgaben (Ordner \"Code\" und \"Korrektur\")!"]
+        dir_name, changed_teams = imported
+        check_cancel(cancel)
 
         logging.debug(f"import_data: Importing to \"{dir_name}\"")
-        # Convert content of dir_name to comments
-        template_file = [t for t in os.listdir(self.path_to_templates) if template in t][0]
-        logging.debug(f"import_data: Using template \"{template}\" ({template_file})")
-
+        # Snapshot of the session folder (name -> is_dir)
+        content_entries = scan_dir(os.path.join(self.path, dir_name))
         logging.debug(f"import_data: Path info:\n"
                       f"self.path: {self.path}\n"
                       f"dir_name: {dir_name}\n"
-                      f"Content: {os.listdir(os.path.join(self.path, dir_name))}")
-
-        self.code_dir = os.path.join(self.path,
-                                     dir_name,
-                                     [i for i in os.listdir(os.path.join(self.path, dir_name)) if
-                                      "Code" in i and os.path.isdir(os.path.join(self.path, dir_name, i))][0],
-                                     "Abgaben")
-        self.pdf_dir = os.path.join(self.path,
-                                    dir_name,
-                                    [i for i in os.listdir(os.path.join(self.path, dir_name)) if
-                                     "Korrektur" in i and os.path.isdir(os.path.join(self.path, dir_name, i))][0],
-                                    "Abgaben")
-        logging.debug(f"Path info:\nCode: {self.code_dir}\nPDFs: {self.pdf_dir}")
-        # Remove files that are not necessary
-        # List of teams to keep
-        team_folders_to_keep = ["Team " + i for i in team_ids]
+                      f"Content: {list(content_entries.keys())}")
+
+        code_dir = os.path.join(self.path,
+                                dir_name,
+                                [i for i, is_dir in content_entries.items() if "Code" in i and is_dir][0],
+                                "Abgaben")
+        pdf_dir = os.path.join(self.path,
+                               dir_name,
+                               [i for i, is_dir in content_entries.items() if "Korrektur" in i and is_dir][0],
+                               "Abgaben")
+        logging.debug(f"Path info:\nCode: {code_dir}\nPDFs: {pdf_dir}")
+
+        # Snapshots of both "Abgaben" directories, reused for validation and removal
+        code_entries = scan_dir(code_dir)
+        pdf_entries = scan_dir(pdf_dir)
+
+        # Errors are collected and shown at the end of the import
+        import_errors = []
         # Check validity (remove non existing team IDs)
-        remove_copy = team_ids[:]
-        for i, t in enumerate(team_folders_to_keep[:]):  # Iterate over copy of the list for safe removal
-            if not (t in os.listdir(self.code_dir) and t in os.listdir(self.pdf_dir)):
-                # Show error
-                messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                     message=f"\"{t}\" existiert nicht! ID wird entfernt.")
+        valid_idx = []
+        for i, t in enumerate(team_ids):
+            if code_entries.get("Team " + t) and pdf_entries.get("Team " + t):
+                valid_idx.append(i)
+            else:
+                # Collect error
+                import_errors.append(f"\"Team {t}\" existiert nicht! ID wird entfernt.")
                 # Log error
-                logging.error(f"import_data: {t} does not exist!")
-                # Remove
-                team_folders_to_keep.remove(t)
-                team_ids.remove(remove_copy[i])
-        logging.debug(f"import_data: Keep teams {team_folders_to_keep}")
+                logging.error(f"import_data: Team {t} does not exist!")
+        # Remove (flags stay aligned with their IDs)
+        team_ids = [team_ids[i] for i in valid_idx]
+        compile_errors = [compile_errors[i] for i in valid_idx]
+        plagiats = [plagiats[i] for i in valid_idx]
+        team_list = team_ids
+
+        # Teams of an existing import which are already graded are kept as well
+        graded_teams = set()
+        if changed_teams is not None:
+            graded_teams = get_graded_teams(pdf_dir)
+            team_list = team_ids + sorted(graded_teams - set(team_ids), key=int)
+            logging.debug(f"import_data: Merge into existing import, graded teams {sorted(graded_teams, key=int)}, "
+                          f"changed submissions {sorted(changed_teams, key=int)}")
+
+        # Remove files that are not necessary
+        # Set of teams to keep
+        team_folders_to_keep = {"Team " + i for i in team_list}
+        logging.debug(f"import_data: Keep teams {team_list}")
 
         # Remove from code_dir and status.csv
-        for f in os.listdir(self.code_dir):
+        for f, is_dir in code_entries.items():
             if f not in team_folders_to_keep:
-                f_to_remove = os.path.join(self.code_dir, f)
-                if os.path.isdir(f_to_remove):
+                f_to_remove = os.path.join(code_dir, f)
+                if is_dir:
                     shutil.rmtree(f_to_remove)
-                elif os.path.isfile(f_to_remove):
+                else:
                     os.remove(f_to_remove)
 
         # Remove from pdf_dir but keep status.csv
-        for f in os.listdir(self.pdf_dir):
+        path_to_status_csv = ""
+        for f, is_dir in pdf_entries.items():
             if f not in team_folders_to_keep and f != "status.csv":
-                f_to_remove = os.path.join(self.pdf_dir, f)
-                if os.path.isdir(f_to_remove):
-                    shutil.rmtree(f_to_remove)
+                if is_dir:
+                    shutil.rmtree(os.path.join(pdf_dir, f))
             elif f == "status.csv":
-                self.path_to_status_csv = os.path.join(self.pdf_dir, f)
-
-        self.states = [State(team_id=team_ids[i],
-                             template_file=os.path.join(self.path_to_templates, template_file),
-                             code_dir=self.code_dir,
-                             pdf_dir=self.pdf_dir,
-                             status_file=self.path_to_status_csv,
-                             compile_error=compile_errors[i],
-                             plagiat=plagiats[i]) for i in range(len(team_ids))]
+                path_to_status_csv = os.path.join(pdf_dir, f)
+        check_cancel(cancel)
+
+        # Parse status.csv once for all teams
+        status_index = StatusIndex(status_file=path_to_status_csv)
+        if not status_index.valid:
+            import_errors.append(status_index.error)
+
+        # Graded teams of an existing import keep their state, all others get a new one
+        session_dir = os.path.join(self.path, dir_name)
+        use_store = self.settings.use_session_store or SessionStore.exists(session_dir)
+        new_idx = [i for i, t in enumerate(team_ids) if t not in graded_teams]
+        states = self._create_states(team_ids=[team_ids[i] for i in new_idx],
+                                     compile_errors=[compile_errors[i] for i in new_idx],
+                                     plagiats=[plagiats[i] for i in new_idx],
+                                     template_file=plan["template_file"],
+                                     code_dir=code_dir,
+                                     pdf_dir=pdf_dir,
+                                     status_index=status_index,
+                                     errors=import_errors,
+                                     save=not use_store,
+                                     progress=progress,
+                                     cancel=cancel)
+        journal = Journal(os.path.join(self.path, dir_name, JOURNAL_FILE))
+        if changed_teams is not None:
+            states += self._merge_states(graded_teams=graded_teams,
+                                         changed_teams=changed_teams,
+                                         code_dir=code_dir,
+                                         pdf_dir=pdf_dir,
+                                         status_index=status_index,
+                                         journal_events=journal.read(),
+                                         errors=import_errors)
+        # All states were saved
+        journal.clear()
+        # Restore the order of the team list
+        states_by_id = {str(s.id): s for s in states}
+        states = [states_by_id[t] for t in team_list if t in states_by_id]
 
         # Check if all teams were found
-        check_ids = [str(i.id) for i in self.states]
-        if not check_ids == self.team_list:
-            missing_teams = [t for t in self.team_list if t not in check_ids]
-            messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                 message=f"IDs {', '.join(missing_teams)} fehlen!"
-                                         f"Es werden nur die existierenden Teams importiert.")
+        check_ids = [str(i.id) for i in states]
+        if not check_ids == team_list:
+            missing_teams = [t for t in team_list if t not in check_ids]
+            import_errors.append(f"IDs {', '.join(missing_teams)} fehlen! "
+                                 f"Es werden nur die existierenden Teams importiert.")
             logging.error(f"import_data: Teams {missing_teams} missing. Importing only {check_ids}.")
-            self.team_list = check_ids
+            team_list = check_ids
+
+        # Everything worked => Switch to the new import
+        self.code_dir = code_dir
+        self.pdf_dir = pdf_dir
+        self.path_to_status_csv = path_to_status_csv
+        self.dir_name = os.path.split(dir_name)[-1]  # Store for later usage
+        self.session_dir = os.path.join(self.path, dir_name)
+        self.team_idx = 0
+        self.team_list = team_list
+        self.journal = journal
+        self.points_matrix = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        if use_store:
+            # Move the states into the session store, only merged teams were read from (and saved to) state.json
+            self.store = SessionStore(session_dir)
+            self.store.save_states([(i, s.snapshot()) for i, s in enumerate(states)])
+            for s in states:
+                if os.path.isfile(s.status_filepath):
+                    os.remove(s.status_filepath)
+            entries = {e["id"]: e for e in self.store.entries()}
+            self.states = [State(manifest_entry=entries[s.id], store=self.store) for s in states]
+        else:
+            self.states = states
+            self.save_manifest()
+            # States were saved while importing, keep only their summary in memory
+            for s in self.states:
+                s.release(save=False)
+        self.loaded_states.clear()
+
+        # All problems of the import are reported at once
+        return import_errors
+
+    def _create_states(self, team_ids: list, compile_errors: list, plagiats: list, template_file: str,
+                       code_dir: str, pdf_dir: str, status_index: StatusIndex, errors: list, save: bool = True,
+                       progress=None, cancel=None):
+        """
+        Creates the states of all teams on a thread pool, since every state mostly waits for the disk
+        (listing, removing and copying files). The order of the returned states follows team_ids.
+
+        :param errors: List to which a message for every team that could not be created is appended
+        :param save: False => No state.json files are written (the states are moved into a session store)
+        :return: List of successfully created states
+        """
+        with ThreadPoolExecutor() as executor:
+            futures = [executor.submit(State,
+                                       team_id=team_ids[i],
+                                       template_file=template_file,
+                                       code_dir=code_dir,
+                                       pdf_dir=pdf_dir,
+                                       status_file=status_index.status_csv,
+                                       compile_error=compile_errors[i],
+                                       plagiat=plagiats[i],
+                                       status_index=status_index,
+                                       save=save) for i in range(len(team_ids))]
+            # Report finished teams, stop scheduling new ones on cancellation
+            for done, _ in enumerate(as_completed(futures), start=1):
+                if progress is not None:
+                    progress(f"Teams erstellt: {done} / {len(futures)}", done, len(futures))
+                if cancel is not None and cancel.is_set():
+                    for f in futures:
+                        f.cancel()
+                    break
+        check_cancel(cancel)
+
+        states = []
+        for team_id, future in zip(team_ids, futures):
+            try:
+                states.append(future.result())
+            except (OSError, ValueError, StateError) as e:
+                logging.error(f"import_data: Could not create state for team {team_id}: {e}")
+                errors.append(f"Team {team_id}: {e}")
+        return states
+
+    def _merge_states(self, graded_teams: set, changed_teams: set, code_dir: str, pdf_dir: str,
+                      status_index: StatusIndex, journal_events: dict, errors: list):
+        """
+        Loads the states of already graded teams after new submissions were merged into an existing import.
+        The grading is kept, only the feedback of the automatic tests and the logins are refreshed from the new
+        status.csv. Teams with a changed submission have to be confirmed again.
+
+        :param journal_events: Unsaved grading changes of the existing import (team id -> events)
+        :param errors: List to which a message for every team that could not be loaded is appended
+        :return: List of the loaded states
+        """
+        states = []
+        for team_id in graded_teams:
+            try:
+                s = State(json_file=os.path.join(pdf_dir, "Team " + team_id, "state.json"),
+                          status_index=status_index)
+                for event in journal_events.get(team_id, []):
+                    s.apply_event(event)
+                if status_index.valid:
+                    s.update_status(status_index)
+                if team_id in changed_teams:
+                    s.confirmed = False
+                    team_code_dir = os.path.join(code_dir, "Team " + team_id)
+                    s.code = [os.path.join(team_code_dir, i) for i in os.listdir(team_code_dir)]
+                    logging.debug(f"import_data: Submission of team {team_id} changed, confirmation reset")
+                s.save()
+                states.append(s)
+            except (OSError, ValueError, StateError) as e:
+                logging.error(f"import_data: Could not merge state of team {team_id}: {e}")
+                errors.append(f"Team {team_id}: {e}")
+        return states
+
+    def _parse_team_ids(self, json_ids: dict):
+        """
+        Reads the team IDs of the current ID key from the content of "tutors_team_ids.json".
+
+        :return: Lists of team IDs, compile errors and plagiats
+        """
+        data_list = json_ids[self.settings.id_key]
+        team_ids = []
+        compile_errors = []
+        plagiats = []
+
+        # Read out data
+        for item in data_list:
+            team_ids.append(str(item[0]))
+            # A bit of security :D
+            if len(item) > 1:
+                compile_errors.append(item[1])
+            else:
+                compile_errors.append(False)
+            if len(item) > 2:
+                plagiats.append(item[2])
+            else:
+                plagiats.append(False)
+        return team_ids, compile_errors, plagiats
 
     def open_data(self):
         logging.debug("manager.py: open_data")
@@ -201,41 +491,87 @@ class Manager:
 
         if chosen_directory:
             logging.debug(f"open_data: Open directory \"{chosen_directory}\"")
-            try:
-                self.code_dir = os.path.join(chosen_directory,
-                                             [i for i in os.listdir(chosen_directory) if
-                                              "Code" in i and os.path.isdir(os.path.join(chosen_directory, i))][0],
-                                             "Abgaben")
-                self.pdf_dir = os.path.join(chosen_directory,
-                                            [i for i in os.listdir(chosen_directory) if
-                                             "Korrektur" in i and os.path.isdir(os.path.join(chosen_directory, i))][0],
-                                            "Abgaben")
-                self.dir_name = os.path.split(chosen_directory)[-1]
-            except OSError:
-                logging.exception("open_data: Directory not found")
-            except IndexError:
-                logging.exception("open_data: Directory is missing")
-
-            try:
-                files = []
-                for team in os.listdir(self.pdf_dir):
-                    if os.path.isdir(os.path.join(self.pdf_dir, team)):
-                        for file in os.listdir(os.path.join(self.pdf_dir, team)):
-                            if file == "state.json":
-                                files.append(os.path.join(self.pdf_dir, team, file))
-                self.states = [State(json_file=f) for f in files]
-                self.team_list = [str(s.id) for s in self.states]
-                logging.debug(f"open_data: Teams {self.team_list} loaded.")
-                if len(self.states) == 0:
-                    logging.exception(f"open_data: No states found in {self.pdf_dir}")
-            except OSError:
-                logging.exception("open_data: OSError while searching for states")
-
+            # Switch under both locks, so a running (auto)save finishes with the previous correction
+            with self.save_lock, self.lock:
+                create_manifest = self._switch_data(chosen_directory)
+            self._replay_journal()
+            if create_manifest:
+                self.save_manifest()
+                with self.lock:
+                    for s in self.states:
+                        s.release(save=False)
             return True
         else:
             logging.debug("open_data aborted by user")
             return False
 
+    def _switch_data(self, chosen_directory: str):
+        """
+        Replaces the session (folders, journal, store and states) by the correction in chosen_directory.
+        Called with self.save_lock and self.lock held.
+
+        :return: True if the states were read from their state.json files and the manifest has to be created
+        """
+        try:
+            self.code_dir = os.path.join(chosen_directory,
+                                         [i for i in os.listdir(chosen_directory) if
+                                          "Code" in i and os.path.isdir(os.path.join(chosen_directory, i))][0],
+                                         "Abgaben")
+            self.pdf_dir = os.path.join(chosen_directory,
+                                        [i for i in os.listdir(chosen_directory) if
+                                         "Korrektur" in i and os.path.isdir(os.path.join(chosen_directory, i))][0],
+                                        "Abgaben")
+            self.dir_name = os.path.split(chosen_directory)[-1]
+            self.session_dir = chosen_directory
+        except OSError:
+            logging.exception("open_data: Directory not found")
+        except IndexError:
+            logging.exception("open_data: Directory is missing")
+
+        self.journal = Journal(os.path.join(self.session_dir, JOURNAL_FILE))
+        self.points_matrix = None
+        self.loaded_states.clear()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        # The session store lists all teams, their states are only read when they are opened
+        if SessionStore.exists(self.session_dir):
+            self.store = SessionStore(self.session_dir)
+            self.states = [State(manifest_entry=e, store=self.store) for e in self.store.entries()]
+            self.team_list = [str(s.id) for s in self.states]
+            logging.debug(f"open_data: Teams {self.team_list} loaded from session store.")
+            return False
+        # The manifest lists all teams, their states are only read when they are opened
+        manifest = self._read_manifest()
+        if manifest is not None:
+            self.states = [State(manifest_entry=e) for e in manifest]
+            self.team_list = [str(s.id) for s in self.states]
+            logging.debug(f"open_data: Teams {self.team_list} loaded from manifest.")
+            return False
+
+        # No manifest (older correction) => Read all states and create it
+        try:
+            files = []
+            for team in os.listdir(self.pdf_dir):
+                if os.path.isdir(os.path.join(self.pdf_dir, team)):
+                    for file in os.listdir(os.path.join(self.pdf_dir, team)):
+                        if file == "state.json":
+                            files.append(os.path.join(self.pdf_dir, team, file))
+            # Shared index for states that still need their logins from status.csv
+            status_index = None
+            if os.path.isfile(os.path.join(self.pdf_dir, "status.csv")):
+                status_index = StatusIndex(status_file=os.path.join(self.pdf_dir, "status.csv"))
+            self.states = [State(json_file=f, status_index=status_index) for f in files]
+            self.team_list = [str(s.id) for s in self.states]
+            logging.debug(f"open_data: Teams {self.team_list} loaded.")
+            if len(self.states) == 0:
+                logging.exception(f"open_data: No states found in {self.pdf_dir}")
+                return False
+            return True
+        except OSError:
+            logging.exception("open_data: OSError while searching for states")
+            return False
+
     def open_team(self, index: int):
         logging.debug("manager.py: open_team")
         logging.debug(f"open_team: Open team at index {index}")
@@ -245,6 +581,41 @@ class Manager:
             logging.debug(f"open_team: Open team {self.team_state.id}")
         except IndexError:
             logging.exception(f"open_team: Index does not exist for states {self.states}")
+            return
+        with self.lock:
+            # Read the full state here, not on the first access of the GUI (the autosave may save it meanwhile)
+            self.team_state.load()
+            self._keep_loaded(self.team_state)
+
+    @contextmanager
+    def _loaded(self, state: State):
+        """
+        Locks the manager while a state is used. A state that was not loaded before is released again afterwards,
+        unless it was changed meanwhile (e.g. states that were only loaded for a search, the statistics or an export).
+        """
+        with self.lock:
+            loaded = state.is_loaded()
+            try:
+                yield state
+            finally:
+                if not loaded and not state.is_dirty():
+                    state.release(save=False)
+
+    def _keep_loaded(self, state: State):
+        """
+        Marks the state as recently opened and releases the least recently opened states if more than
+        MAX_LOADED_STATES are in memory.
+        """
+        self.loaded_states[state.id] = state
+        self.loaded_states.move_to_end(state.id)
+        # Changed states stay in memory until the autosave wrote them
+        for team_id in list(self.loaded_states.keys()):
+            if len(self.loaded_states) <= MAX_LOADED_STATES:
+                break
+            oldest = self.loaded_states[team_id]
+            if oldest is not state and not oldest.is_dirty():
+                del self.loaded_states[team_id]
+                oldest.release(save=False)
 
     def open_pdf(self):
         logging.debug("manager.py: open_pdf")
@@ -292,10 +663,120 @@ class Manager:
                 subprocess.Popen([self.team_state.code[0]], shell=True)
 
     def save(self):
+        """
+        Writes all states changed since the last save and the manifest. Thread-safe, used by the autosave: The
+        states are only locked while they are copied, the files are written afterwards.
+        """
         logging.debug("manager.py: save")
-        for i in self.states:
-            i.save()
-        logging.debug("save: Saved successfully")
+        with self.save_lock:
+            # Only write states which were changed since the last save
+            with self.lock:
+                changed = [(i, s, s.snapshot()) for i, s in enumerate(self.states) if s.is_dirty()]
+                journal = self.journal
+                store = self.store
+                # Changes from now on go to a new journal file
+                journal.rotate()
+            failed = False
+            if store is not None:
+                # All states in one transaction
+                try:
+                    store.save_states([(i, data) for i, _, data in changed])
+                except sqlite3.Error:
+                    logging.exception("save: Could not save states in session store")
+                    for _, s, _ in changed:
+                        s.set_dirty()
+                    failed = True
+            else:
+                for _, s, data in changed:
+                    try:
+                        atomic_write_json(s.status_filepath, data)
+                    except OSError:
+                        logging.exception(f"save: Could not save team {s.id}")
+                        s.set_dirty()
+                        failed = True
+            if len(changed) > 0:
+                with self.lock:
+                    # States loaded only for saving (or evicted while being written) are released again
+                    for _, s, _ in changed:
+                        s.written()
+                        if s.id not in self.loaded_states and s is not self.team_state and not s.is_dirty():
+                            s.release(save=False)
+                    # The session store replaces the manifest
+                    manifest = self._manifest_data() if store is None else None
+                self._write_manifest(manifest)
+            # All changes are in the states now (the rotated journal is kept for the next start otherwise)
+            if not failed:
+                journal.clear_rotated()
+        logging.debug(f"save: Saved {len(changed)} changed states successfully")
+
+    def _replay_journal(self):
+        """
+        Applies the grading changes of the journal which did not make it into the states (e.g. after a crash) and
+        saves the affected states.
+        """
+        events = self.journal.read()
+        if len(events) == 0:
+            return
+        logging.warning(f"_replay_journal: Restoring unsaved changes of teams {list(events.keys())}")
+        for s in self.states:
+            for event in events.get(str(s.id), []):
+                s.apply_event(event)
+        self.save()
+
+    def save_manifest(self):
+        """
+        Writes the session manifest (team order, confirmed flags, total points, state files and their modification
+        times), which lets open_data show a correction without reading every state.json.
+        """
+        self._write_manifest(self._manifest_data())
+
+    def _manifest_data(self):
+        """
+        :return: Content of the session manifest or None if there is no open correction
+        """
+        if not self.session_dir or len(self.states) == 0:
+            return None
+        teams = []
+        for s in self.states:
+            entry = s.summary()
+            entry["state_file"] = os.path.relpath(entry["state_file"], self.session_dir)
+            teams.append(entry)
+        return {"version": MANIFEST_VERSION, "teams": teams}
+
+    def _write_manifest(self, manifest: dict):
+        if manifest is None:
+            return
+        try:
+            atomic_write_json(os.path.join(self.session_dir, MANIFEST_FILE), manifest)
+        except OSError:
+            logging.exception("save_manifest: Could not write manifest")
+
+    def _read_manifest(self):
+        """
+        Reads the session manifest of the current session directory.
+
+        :return: List of manifest entries (with absolute state file paths) or None if there is no valid manifest
+        """
+        path_to_manifest = os.path.join(self.session_dir, MANIFEST_FILE)
+        if not os.path.isfile(path_to_manifest):
+            return None
+        try:
+            with open(path_to_manifest, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["version"] != MANIFEST_VERSION:
+                logging.warning(f"_read_manifest: Unknown manifest version {manifest['version']}")
+                return None
+            teams = manifest["teams"]
+            for entry in teams:
+                entry["id"] = int(entry["id"])
+                entry["confirmed"] = bool(entry["confirmed"])
+                entry["state_file"] = os.path.join(self.session_dir, entry["state_file"])
+        except (OSError, ValueError, KeyError, TypeError):
+            logging.exception(f"_read_manifest: Invalid manifest \"{path_to_manifest}\"")
+            return None
+        if len(teams) == 0:
+            return None
+        return teams
 
     # Main frame functions
     def get_id(self):
@@ -309,71 +790,99 @@ class Manager:
 
     def switch_confirmed(self):
         logging.debug("manager.py: switch_confirmed")
-        self.team_state.confirmed = not self.team_state.confirmed
+        with self.lock:
+            self.team_state.confirmed = not self.team_state.confirmed
+            self._record_change({"team": self.team_state.id, "flag": "confirmed", "value": self.team_state.confirmed})
         logging.debug(f"switch_confirmed: Team {self.team_state.id}: {self.team_state.confirmed}")
 
     def get_total_points(self):
         """
         :return: Total points in format {"actual": ..., "max": ...}
         """
-        return self.team_state.comment["total_points"]
+        return self.team_state.grading.total_points()
 
     def get_class_points(self, class_str):
-        return self.team_state.comment["classes"][self.get_class_idx(class_str)]["points"]
+        return self.team_state.grading.class_points(self.get_class_idx(class_str))
 
     def get_task_points(self, class_str, task_str):
-        return self.team_state.comment["classes"][self.get_class_idx(class_str)]["tasks"][
-            self.get_task_idx(class_str, task_str)]["points"]
+        return self.team_state.grading.task_points(*self.get_idx(class_str, task_str))
+
+    def get_class_titles(self):
+        """
+        :return: Titles of all classes of the current team
+        """
+        return self.team_state.grading.template.class_titles
+
+    def get_task_titles(self, class_str):
+        """
+        :return: Titles of all tasks of a class of the current team
+        """
+        class_idx = self.get_class_idx(class_str)
+        if class_idx is None:
+            return ()
+        template = self.team_state.grading.template
+        return template.task_titles[template.class_start[class_idx]:template.class_start[class_idx + 1]]
 
     def get_compile_error(self):
-        return self.team_state.comment["compile_error"]
+        return self.team_state.grading.compile_error
 
     def switch_compile_error(self):
         logging.debug("manager.py: switch_compile_error")
-        self.team_state.comment["compile_error"] = not self.team_state.comment["compile_error"]
-        logging.debug(f"switch_compile_error: Team {self.team_state.id}: {self.team_state.comment['compile_error']}")
+        with self.lock:
+            grading = self.team_state.grading
+            grading.compile_error = not grading.compile_error
+            self.update_total_points()
+            self._record_change({"team": self.team_state.id, "flag": "compile_error", "value": grading.compile_error})
+        logging.debug(f"switch_compile_error: Team {self.team_state.id}: {grading.compile_error}")
 
     def get_plagiat(self):
-        return self.team_state.comment["plagiat"]
+        return self.team_state.grading.plagiat
 
     def switch_plagiat(self):
         logging.debug("manager.py: switch_plagiat")
-        self.team_state.comment["plagiat"] = not self.team_state.comment["plagiat"]
-        logging.debug(f"switch_plagiat: Team {self.team_state.id}: {self.team_state.comment['plagiat']}")
+        with self.lock:
+            grading = self.team_state.grading
+            grading.plagiat = not grading.plagiat
+            self.update_total_points()
+            self._record_change({"team": self.team_state.id, "flag": "plagiat", "value": grading.plagiat})
+        logging.debug(f"switch_plagiat: Team {self.team_state.id}: {grading.plagiat}")
 
     def get_class_idx(self, class_str):
-        for idx, i in enumerate(self.team_state.comment["classes"]):
-            if i["title"] == class_str:
-                return idx
-        logging.error(f"manager.py: get_class_idx: Class \"{class_str}\" does not exist in current status file")
-        return None
+        class_idx = self.team_state.grading.template.class_idx.get(class_str)
+        if class_idx is None:
+            logging.error(f"manager.py: get_class_idx: Class \"{class_str}\" does not exist in current status file")
+        return class_idx
 
     def get_task_idx(self, class_str, task_str):
-        class_idx = self.get_class_idx(class_str)
-        if class_idx is not None:
-            for idx, i in enumerate(self.team_state.comment["classes"][class_idx]["tasks"]):
-                if i["title"] == task_str:
-                    return idx
+        idx = self.team_state.grading.template.task_idx.get((class_str, task_str))
+        if idx is None:
             logging.error(f"Class \"{class_str}\" has no task \"{task_str}\"!")
-        return None
+            return None
+        return idx[1]
 
-    def update_total_points(self):
-        total_sum = 0.
-        if not self.team_state.comment["compile_error"] and not self.team_state.comment["plagiat"]:
-            for i, c in enumerate(self.team_state.comment["classes"]):
-                self.update_class_points(c["title"])
-                total_sum += self.team_state.comment["classes"][i]["points"]["actual"]
-        self.team_state.comment["total_points"]["actual"] = min(total_sum,
-                                                                self.team_state.comment["total_points"]["max"])
-
-    def update_class_points(self, class_str: str):
-        summed_points = 0.
-        idx = self.get_class_idx(class_str)
+    def get_idx(self, class_str, task_str):
+        """
+        :return: (class_idx, task_idx) of a task, None if it does not exist
+        """
+        idx = self.team_state.grading.template.task_idx.get((class_str, task_str))
         if idx is None:
-            return
-        for t in self.team_state.comment["classes"][idx]["tasks"]:
-            summed_points += t["points"]["actual"]
-        self.team_state.comment["classes"][idx]["points"]["actual"] = summed_points
+            logging.error(f"Class \"{class_str}\" has no task \"{task_str}\"!")
+        return idx
+
+    def update_total_points(self):
+        self.team_state.update_total_points()
+
+    def _record_change(self, event: dict):
+        """
+        Marks the current state as changed, writes the change to the journal and schedules the autosave.
+
+        :param event: Journal event (see State.apply_event)
+        """
+        self.team_state.set_dirty()
+        self.journal.append(event)
+        self.autosave.schedule()
+        if self.points_matrix is not None:
+            self.points_matrix.set_row(self.team_idx, self.team_state.grading)
 
     def increase_task_points(self, class_str: str, task_str: str):
         """
@@ -383,16 +892,15 @@ class Manager:
         :param class_str: Title of the class
         :param task_str: Title of the task
         """
-        class_idx = self.get_class_idx(class_str)
-        if class_idx is not None:
-            task_idx = self.get_task_idx(class_str, task_str)
-            if task_idx is not None:
-                self.team_state.comment["classes"][class_idx]["tasks"][task_idx]["points"]["actual"] = min(
-                    self.team_state.comment["classes"][class_idx]["tasks"][task_idx]["points"]["actual"] + 0.5,
-                    self.team_state.comment["classes"][class_idx]["tasks"][task_idx]["points"]["max"]
-                )
+        idx = self.get_idx(class_str, task_str)
+        if idx is not None:
+            with self.lock:
+                grading = self.team_state.grading
+                grading.set_task_points(*idx, grading.task_points(*idx)["actual"] + 0.5)
                 # Update total points after updating task points
                 self.update_total_points()
+                self._record_change({"team": self.team_state.id, "class": class_str, "task": task_str,
+                                     "actual": grading.task_points(*idx)["actual"]})
 
     def decrease_task_points(self, class_str: str, task_str: str):
         """
@@ -402,16 +910,109 @@ class Manager:
         :param class_str: Title of the class
         :param task_str: Title of the task
         """
-        class_idx = self.get_class_idx(class_str)
-        if class_idx is not None:
-            task_idx = self.get_task_idx(class_str, task_str)
-            if task_idx is not None:
-                self.team_state.comment["classes"][class_idx]["tasks"][task_idx]["points"]["actual"] = max(
-                    self.team_state.comment["classes"][class_idx]["tasks"][task_idx]["points"]["actual"] - 0.5,
-                    0.
-                )
+        idx = self.get_idx(class_str, task_str)
+        if idx is not None:
+            with self.lock:
+                grading = self.team_state.grading
+                grading.set_task_points(*idx, grading.task_points(*idx)["actual"] - 0.5)
                 # Update total points after updating task points
                 self.update_total_points()
+                self._record_change({"team": self.team_state.id, "class": class_str, "task": task_str,
+                                     "actual": grading.task_points(*idx)["actual"]})
+
+    def find_teams(self, team_ids: list = None, unconfirmed_only: bool = False, feedback_pattern: str = ""):
+        """
+        Selects teams for a bulk change. A team is selected if it matches all given criteria.
+
+        :param team_ids: IDs of the teams, None => All teams
+        :param unconfirmed_only: Only select teams which are not confirmed
+        :param feedback_pattern: Regular expression searched in the test feedback (auto_correction_result), empty =>
+                                 Any feedback
+        :return: Indices of the selected teams in the team list
+        :raises re.error: If the pattern is not a valid regular expression
+        """
+        pattern = re.compile(feedback_pattern) if feedback_pattern else None
+        ids = {str(i).strip() for i in team_ids} if team_ids is not None else None
+        res = []
+        with self.lock:
+            for idx, s in enumerate(self.states):
+                if ids is not None and str(s.id) not in ids:
+                    continue
+                if unconfirmed_only and s.confirmed:
+                    continue
+                if pattern is not None:
+                    with self._loaded(s):
+                        feedback = s.auto_correction_result
+                    if pattern.search(feedback) is None:
+                        continue
+                res.append(idx)
+        logging.debug(f"find_teams: Selected {len(res)} teams")
+        return res
+
+    def bulk_change(self, indices: list, class_str: str = None, task_str: str = None, delta: float = 0.,
+                    compile_error: bool = None, plagiat: bool = None):
+        """
+        Applies the same change to several teams in one pass and saves once afterwards. Task points are limited to
+        [0, max] like in increase_task_points/decrease_task_points, changed teams are no longer confirmed.
+
+        :param indices: Indices of the teams in the team list (see find_teams)
+        :param class_str: Title of the class of the changed task, None => No point change
+        :param task_str: Title of the task
+        :param delta: Points added to the task (negative => deduction)
+        :param compile_error: New compile error flag, None => Unchanged
+        :param plagiat: New plagiat flag, None => Unchanged
+        :return: Number of changed teams
+        """
+        logging.debug("manager.py: bulk_change")
+        events = []
+        changed = 0
+        with self.lock:
+            for idx in indices:
+                s = self.states[idx]
+                grading = s.grading
+                team_events = []
+                if class_str is not None and delta != 0:
+                    task = grading.template.task_idx.get((class_str, task_str))
+                    if task is None:
+                        logging.error(f"bulk_change: Team {s.id}: Class \"{class_str}\" has no task \"{task_str}\"!")
+                    else:
+                        points = grading.task_points(*task)
+                        actual = min(max(points["actual"] + delta, 0.), points["max"])
+                        if actual != points["actual"]:
+                            team_events.append({"team": s.id, "class": class_str, "task": task_str, "actual": actual})
+                if compile_error is not None and grading.compile_error != compile_error:
+                    team_events.append({"team": s.id, "flag": "compile_error", "value": compile_error})
+                if plagiat is not None and grading.plagiat != plagiat:
+                    team_events.append({"team": s.id, "flag": "plagiat", "value": plagiat})
+                if len(team_events) == 0:
+                    continue
+                # Changed teams have to be confirmed again, like when grading a single team
+                if s.confirmed:
+                    team_events.insert(0, {"team": s.id, "flag": "confirmed", "value": False})
+                for event in team_events:
+                    s.apply_event(event)
+                if self.points_matrix is not None:
+                    self.points_matrix.set_row(idx, grading)
+                events += team_events
+                changed += 1
+            self.journal.extend(events)
+        # States only loaded for the change are released by the save
+        self.save()
+        logging.debug(f"bulk_change: Changed {changed} of {len(indices)} teams")
+        return changed
+
+    def get_feedback(self, state: State = None):
+        """
+        Feedback of a team exactly as it is exported to StudOn (including the personal annotation).
+
+        :param state: State of the team, None => Current team
+        :return: (total points, feedback)
+        """
+        with self.lock:
+            if state is None:
+                state = self.team_state
+            points, feedback = state.export(self.settings.compile_error_annotation, self.settings.plagiat_annotation)
+        return points, f"{feedback}\n{self.settings.personal_annotation}"
 
     def save_personal_comment(self, comments: list):
         logging.debug("manager.py: save_personal_comment")
@@ -420,10 +1021,11 @@ class Manager:
         self.settings.plagiat_annotation = comments[1].rstrip("\n")
         self.settings.personal_annotation = comments[2].rstrip("\n")
         self.settings.id_key = comments[3].strip()
+        self.settings.use_session_store = comments[4]
         self.settings.save()
         logging.debug(f"save_personal_comment: Saved \"{self.settings.compile_error_annotation}\"\n"
                       f"\"{self.settings.plagiat_annotation}\"\n\"{self.settings.personal_annotation}\"\n"
-                      f"Key: \"{self.settings.id_key}\"")
+                      f"Key: \"{self.settings.id_key}\"\nSession store: {self.settings.use_session_store}")
 
     def save_graphics(self, fonts: list[str], sizes: list[int], colors: list[str]):
         logging.debug("manager.py: save_graphics")
@@ -433,178 +1035,281 @@ class Manager:
         self.graphics.save()
         logging.debug(f"save_graphics: Saved new graphics settings")
 
-    def export(self, folder_name: str = None):
-        logging.debug("manager.py: export")
+    def get_points_matrix(self):
+        """
+        Creates the points matrix of all teams on first use, afterwards it is kept in sync with every change.
+
+        :return: PointsMatrix or None if no correction is opened
+        """
+        with self.lock:
+            if self.points_matrix is None and len(self.states) > 0:
+                matrix = None
+                for row, s in enumerate(self.states):
+                    with self._loaded(s):
+                        if matrix is None:
+                            matrix = PointsMatrix(s.grading.template, len(self.states))
+                        matrix.set_row(row, s.grading)
+                logging.debug(f"get_points_matrix: Created matrix of {matrix.n_teams()} teams")
+                self.points_matrix = matrix
+            return self.points_matrix
+
+    def validate_export(self):
+        """
+        Checks everything the export needs in a single read-only pass (team folders, Korrektur.pdf files, status.csv
+        rows, confirmed flags and templates). Uses the state summaries, no state is loaded.
+
+        :return: ValidationReport
+        """
+        logging.debug("manager.py: validate_export")
+        report = ValidationReport()
+        report.n_teams = len(self.states)
+        with self.lock:
+            summaries = [s.summary() for s in self.states]
+
+        # status.csv: Every team needs exactly one row, rows of other teams must not be marked as updated
+        status_index = StatusIndex(status_file=os.path.join(self.pdf_dir, "status.csv"))
+        if not status_index.valid:
+            report.add_error(status_index.error)
+        else:
+            report.status_index = status_index
+            status_df = status_index.dataframe
+            row_counts = status_df[status_index.id_col].value_counts()
+            team_ids = {str(e["id"]) for e in summaries}
+            for e in summaries:
+                count = int(row_counts.get(str(e["id"]), 0))
+                if count == 0:
+                    report.add_error("Nicht in \"status.csv\" gefunden", str(e["id"]))
+                elif count > 1:
+                    report.add_error(f"{count} Zeilen in \"status.csv\"", str(e["id"]))
+            # A missing "update" column is added by the export
+            if "update" in status_df:
+                updated = status_df.loc[status_df["update"] == 1, status_index.id_col]
+                for team_id in updated[~updated.isin(team_ids)]:
+                    report.add_error("In \"status.csv\" bereits als aktualisiert markiert, aber nicht Teil der "
+                                     "Korrektur", team_id)
+
+        # Team folders and PDFs
+        team_folders = get_team_folders(self.pdf_dir)
+        report.pdf_paths = self._get_pdf_paths([str(e["id"]) for e in summaries], team_folders)
+        for e in summaries:
+            team_id = str(e["id"])
+            if team_id not in team_folders:
+                report.add_warning("Kein Team-Ordner gefunden", team_id)
+            elif report.pdf_paths[team_id] is None:
+                report.add_warning("Korrektur.pdf fehlt", team_id)
+
+        # Confirmed flags and templates (all teams of a correction are graded with the same template)
+        for e in summaries:
+            if not e["confirmed"]:
+                report.add_warning("Noch nicht bestätigt", str(e["id"]))
+        total_max = {e["total_points"]["max"] for e in summaries}
+        if len(total_max) > 1:
+            report.add_warning(f"Unterschiedliche Maximalpunktzahlen der Teams: "
+                               f"{', '.join(str(m) for m in sorted(total_max))} (verschiedene Templates?)")
+        logging.debug(f"validate_export: {len(report.errors)} errors, {len(report.warnings)} warnings")
+        return report
+
+    def _get_pdf_paths(self, team_ids: list, team_folders: dict = None):
+        """
+        Finds the Korrektur.pdf of every team with a single scan of the Korrektur folder.
+
+        :param team_folders: Result of get_team_folders, None => Scan the folder
+        :return: Dict team id -> path to Korrektur.pdf, None if the team folder or the PDF does not exist
+        """
+        if team_folders is None:
+            team_folders = get_team_folders(self.pdf_dir)
+        pdf_paths = {}
+        for team_id in team_ids:
+            if team_id not in team_folders:
+                logging.warning(f"manager.py: No folder found for team {team_id} in \"{self.pdf_dir}\"")
+                pdf_paths[team_id] = None
+                continue
+            pdf_path = os.path.join(self.pdf_dir, team_folders[team_id], "Korrektur.pdf")
+            if not os.path.isfile(pdf_path):
+                logging.warning(f"manager.py: Korrektur.pdf not found for team {team_id} at expected location "
+                                f"'{pdf_path}'")
+                pdf_path = None
+            pdf_paths[team_id] = pdf_path
+        return pdf_paths
+
+    def prepare_export(self, folder_name: str, compression: str = None, report: ValidationReport = None):
+        """
+        First part of the export, runs on the GUI thread: Checks the folder name and asks whether an existing zip
+        file may be replaced.
+
+        :param folder_name: Name of the folder in the zip file (given by StudOn)
+        :param compression: Compression of the zip entries (key of EXPORT_COMPRESSION), None => Last used one
+        :param report: Result of validate_export, status.csv and the team folders are not read again
+        :return: Dict describing the export (input of export) or None if the export is not possible
+        """
+        logging.debug("manager.py: prepare_export")
+        if compression is not None and compression != self.settings.export_compression:
+            # Remember the choice for the next export
+            self.settings.export_compression = compression
+            self.settings.save()
         if folder_name == "":
             messagebox.showerror(title="AuD-GUI :D - Fehler!",
                                  message="Name des Export-Ordners darf nicht leer sein!")
-            logging.error("export: Zip-folder name empty")
-            return
-        # If no zip_name is given, use default name with date and time
+            logging.error("prepare_export: Zip-folder name empty")
+            return None
+        # Default name with date and time
         zip_name = f"AuD_Export_{str(pd.Timestamp.now().strftime('%Y-%m-%d_%H-%M'))}"
-        logging.debug(f"export: ZIP-name \"{zip_name}\"")
+        zip_path = os.path.join(self.path_to_output, self.dir_name, f"{zip_name}.zip")
+        logging.debug(f"prepare_export: Try to export to \"{zip_path}\"")
+
+        # Check if the zip file already exists
+        if os.path.isfile(zip_path):
+            logging.debug(f"prepare_export: File \"{zip_path}\" already exists")
+            # Ask for permission to replace it
+            replace_zip = messagebox.askokcancel(title="AuD-GUI :D - Warnung!",
+                                                 message=f"Datei {zip_path} existiert bereits. "
+                                                         f"Datei durch neuen Inhalt ersetzen? "
+                                                         f"(Bisheriger Inhalt wird gelöscht!)")
+            if not replace_zip:
+                # Cancel operation if the file is not replaced
+                logging.debug("prepare_export: Permission not given -> abort")
+                return None
+        return {"folder_name": folder_name,
+                "zip_path": zip_path,
+                "compression": self.settings.export_compression,
+                "status_index": report.status_index if report is not None else None,
+                "pdf_paths": report.pdf_paths if report is not None else None}
+
+    def export(self, plan: dict, progress=None, cancel=None):
+        """
+        Second part of the export, may run on a worker thread since it does not open any dialogs: Creates the
+        feedback of all teams, updates status.csv and writes the zip file. The states stay usable meanwhile.
+
+        :param plan: Result of prepare_export
+        :param progress: Optional callback progress(text, done, total)
+        :param cancel: Optional threading.Event, raises ExportCancelled (no zip file is left behind)
+        :return: Tuple (list of error messages (empty if everything worked), IDs of the teams that were changed
+                 while the export was running, the zip file contains their previous points and feedback).
+                 The zip file is written unless an error occurs before (missing PDFs are only reported).
+        """
+        logging.debug("manager.py: export")
+        folder_name, zip_path = plan["folder_name"], plan["zip_path"]
 
         res = []
-        for s in self.states:
-            points, feedback = s.export(self.settings.compile_error_annotation, self.settings.plagiat_annotation)
-            feedback += f"\n{self.settings.personal_annotation}"
+        versions = []  # Version of every state when its feedback was created
+        for i, s in enumerate(self.states):
+            if cancel is not None and cancel.is_set():
+                raise ExportCancelled()
+            # The GUI may open or change teams meanwhile
+            with self._loaded(s):
+                # Teams that were not changed since their last export or preview are not rendered (or loaded) again
+                points, feedback = self.get_feedback(s)
+                versions.append(s.version())
             res.append((str(s.id), points, feedback))  # Add ID, total points, comment feedback
+            if progress is not None and (i % 50 == 0 or i == len(self.states) - 1):
+                progress(f"Feedback erstellen ({i + 1}/{len(self.states)})", i + 1, len(self.states))
         logging.debug("export: Created export list successfully")
 
-        export_path = os.path.join(self.path_to_output, self.dir_name, zip_name, folder_name)
-        logging.debug(f"Try to export to \"{export_path}\"")
-
-        # Check if directory already exist
-        if os.path.isdir(export_path):
-            logging.debug(f"export: Directory \"{export_path}\" already exists")
-            # Ask for permission to delete it
-            remove_dir = messagebox.askokcancel(title="AuD-GUI :D - Warnung!",
-                                                message=f"Ordner {export_path} existiert bereits. "
-                                                        f"Ordner durch neuen Inhalt ersetzen? "
-                                                        f"(Bisheriger Inhalt wird gelöscht!)")
-            if remove_dir:
-                logging.debug(f"export: Permission given -> remove directory \"{export_path}\"")
-                shutil.rmtree(export_path)
-            else:
-                # Cancel operation if ordner deletion is not performed
-                logging.debug("export: Permission not given -> abort")
-                return
-
-        shutil.copytree(src=self.pdf_dir, dst=export_path)
-        logging.debug(f"export: Copy folder \"{self.pdf_dir}\" to \"{export_path}\"")
-
-        path_to_status_csv = os.path.join(export_path, "status.csv")
-
-        # Move status.csv one directory up
-        parent_dir = os.path.dirname(export_path)
-        logging.debug(f"export: Move status.csv one directory up to \"{parent_dir}\"")
-        new_status_csv_location = os.path.join(parent_dir, "status.csv")
-        if os.path.isfile(path_to_status_csv):
-            # Check if target file already exists
-            if os.path.exists(new_status_csv_location):
-                logging.warning(f"export: Target File \"{new_status_csv_location}\" already exists and will be overwritten")
-                try:
-                    os.remove(new_status_csv_location)
-                except OSError:
-                    logging.exception("export: Could not remove existing status.csv file")
-            try:
-                shutil.move(path_to_status_csv, new_status_csv_location)
-                logging.debug(f"export: status.csv moved to \"{new_status_csv_location}\"")
-                path_to_status_csv = new_status_csv_location
-            except OSError:
-                logging.exception("export: Could not move status.csv file")
-        else:
-            logging.error(f"export: status.csv not found in \"{path_to_status_csv}\"")
-
-        try:
+        # status.csv as read by validate_export
+        status_index = plan.get("status_index")
+        if status_index is None:
+            path_to_status_csv = os.path.join(self.pdf_dir, "status.csv")
             logging.debug(f"export: Try to open \"{path_to_status_csv}\"")
-            with open(path_to_status_csv, encoding="utf-8", errors="backslashreplace") as input_fd:
-                status_df = pd.read_csv(input_fd)
-        except OSError:
-            messagebox.showerror(title="AuD-GUI :D - Fehler!", message="status.csv existiert nicht!")
-            logging.exception("export: status.csv not found")
-            return
-
-        # Find column with ID (Could be team_id or usr_id)
-        id_col = [i for i in status_df.keys() if "id" in i][0]
+            status_index = StatusIndex(status_file=path_to_status_csv)
+        if not status_index.valid:
+            logging.error("export: status.csv not found or invalid")
+            return [status_index.error], []
+        # The index stays unchanged, another export may use it as well
+        status_df = status_index.dataframe.copy()
+        id_col = status_index.id_col
+
+        # Report teams that cannot be updated before touching the data
+        missing_teams = [team_id for team_id, _, _ in res if team_id not in status_index]
+        if missing_teams:
+            logging.warning(f"export: Teams {missing_teams} not found in status.csv")
 
         # Cast column values to correct dtype
         status_df["mark"] = status_df["mark"].astype(float)
         status_df[id_col] = status_df[id_col].astype(str)
 
-        for team_id, team_points, team_comment in res:
-
-            #  Find team folder and rename it to "Team_<team_id>"
-            team_folder = [t for t in os.listdir(export_path) if team_id in t][0]
-            old_team_path = os.path.join(export_path, team_folder)
-            new_team_folder_name = f"Team_{team_id}"
-            new_team_path = os.path.join(export_path, new_team_folder_name)
-
-            if team_folder != new_team_folder_name:
-                try:
-                    os.rename(old_team_path, new_team_path)
-                    logging.debug(f"export: Rename team folder '{team_folder}' -> '{new_team_folder_name}'")
-                except OSError:
-                    logging.exception(
-                        f"export: Could not rename team folder '{old_team_path}' to '{new_team_path}'")
-                    new_team_path = old_team_path # Fallback
-            else:
-                new_team_path = old_team_path
-
-            # Create subfolder "Korrekturen" if not existent and move Korrektur.pdf there
-            korrekturen_path = os.path.join(new_team_path, "Korrekturen")
-            os.makedirs(korrekturen_path, exist_ok=True)
-
-            src_pdf_in_root = os.path.join(new_team_path, "Korrektur.pdf")
-            dst_pdf_in_korr = os.path.join(korrekturen_path, "Korrektur.pdf")
-
-            if os.path.isfile(src_pdf_in_root):
-                try:
-                    # If target file already exists, remove it first
-                    if os.path.exists(dst_pdf_in_korr):
-                        os.remove(dst_pdf_in_korr)
-                    shutil.move(src_pdf_in_root, dst_pdf_in_korr)
-                    logging.debug(f"export: Move Korrektur.pdf to '{dst_pdf_in_korr}'")
-                except OSError:
-                    logging.exception("export: Could not move Korrektur.pdf into 'Korrekturen' folder")
-            else:
-                # If Korrektur.pdf is not found, log a warning
-                if not os.path.isfile(dst_pdf_in_korr):
-                    logging.warning(
-                        f"export: Korrektur.pdf not found for team {team_id} at expected location '{src_pdf_in_root}'")
-
-            # Remove all other files and folders in the team folder except the "Korrekturen" folder
-            for entry in os.listdir(new_team_path):
-                if entry != "Korrekturen":
-                    p = os.path.join(new_team_path, entry)
-                    try:
-                        if os.path.isdir(p):
-                            shutil.rmtree(p)
-                        else:
-                            os.remove(p)
-                        logging.debug(f"export: Remove '{p}'")
-                    except OSError:
-                        logging.exception(f"export: Could not remove '{p}'")
-
-            # Clean up Korrekturen folder (remove everything except Korrektur.pdf) just in case
-            for entry in os.listdir(korrekturen_path):
-                if entry != "Korrektur.pdf":
-                    p = os.path.join(korrekturen_path, entry)
-                    try:
-                        if os.path.isdir(p):
-                            shutil.rmtree(p)
-                        else:
-                            os.remove(p)
-                        logging.debug(f"export: Remove '{p}' from Korrekturen folder")
-                    except OSError:
-                        logging.exception(f"export: Could not remove '{p}' from Korrekturen folder")
-
-            # Set score
-            status_df.loc[status_df[id_col] == team_id, "mark"] = team_points
-            # Set comment
-            status_df.loc[status_df[id_col] == team_id, "comment"] = team_comment
-            # Set update column to 1
-            status_df.loc[status_df[id_col] == team_id, "update"] = 1
+        # Set score, comment and update flag of all exported teams at once
+        results = pd.DataFrame(res, columns=[id_col, "mark", "comment"]).set_index(id_col)
+        rows = status_df[id_col].isin(results.index)
+        row_ids = status_df.loc[rows, id_col]
+        status_df["comment"] = status_df["comment"].astype(object)
+        status_df.loc[rows, "mark"] = row_ids.map(results["mark"]).to_numpy(dtype=float)
+        status_df.loc[rows, "comment"] = row_ids.map(results["comment"]).to_numpy(dtype=object)
+        status_df.loc[rows, "update"] = 1
 
         # Check if all updates were done
         if not check_updates(status_df, self.team_list):
-            messagebox.showerror(title="AuD-GUI :D - Fehler!",
-                                 message="Die Anzahl an Updates stimmt nicht überein!")
             logging.error("export: Number of updates in status.csv is not correct")
-            return
+            return ["Die Anzahl an Updates stimmt nicht überein!"], []
+
+        # Korrektur.pdf of every team as found by validate_export
+        pdf_paths = plan.get("pdf_paths")
+        if pdf_paths is None or any(team_id not in pdf_paths for team_id, _, _ in res):
+            pdf_paths = self._get_pdf_paths([team_id for team_id, _, _ in res])
+        teams = [(team_id, pdf_paths[team_id]) for team_id, _, _ in res]
+
+        # Teams that did not change since the last export are copied forward from its zip file
+        cache_path = os.path.join(os.path.dirname(zip_path), EXPORT_CACHE_FILE)
+        cache = self._read_export_cache(cache_path)
+        keys = {team_id: self._export_key(points, feedback, pdf_path)
+                for (team_id, points, feedback), (_, pdf_path) in zip(res, teams)}
+        reuse = {team_id for team_id, key in keys.items() if cache["teams"].get(team_id) == key}
+        previous_zip = os.path.join(os.path.dirname(zip_path), cache["zip"]) if cache["zip"] else None
+
+        # Write the StudOn layout straight into the zip file
+        status_csv = status_df.to_csv(index=False, quoting=csv.QUOTE_ALL, float_format="%g")
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        errors = []
+        reused = write_export_zip(zip_path, folder_name, teams, status_csv, compression=plan["compression"],
+                                  progress=progress, cancel=cancel, previous_zip=previous_zip, reuse=reuse,
+                                  errors=errors)
+        atomic_write_json(cache_path, {"zip": os.path.basename(zip_path), "teams": keys})
+        logging.debug(f"export: Exported to zip file \"{zip_path}\", {reused} of {len(teams)} teams copied from "
+                      f"\"{previous_zip}\"")
+
+        # Grading continues during the export => Find teams whose exported points or feedback are outdated
+        changed_teams = []
+        with self.lock:
+            for s, version, (team_id, points, feedback) in zip(self.states, versions, res):
+                if s.version() != version and self.get_feedback(s) != (points, feedback):
+                    changed_teams.append(team_id)
+        if changed_teams:
+            logging.warning(f"export: Teams {changed_teams} were changed during the export")
+        return errors, changed_teams
+
+    @staticmethod
+    def _read_export_cache(cache_path: str):
+        """
+        :return: Export cache ({"zip": name of the last zip file, "teams": team id -> hash}), empty if there is none
+        """
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            return {"zip": cache["zip"], "teams": cache["teams"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {"zip": None, "teams": {}}
+
+    @staticmethod
+    def _export_key(points: float, feedback: str, pdf_path: str):
+        """
+        :return: Hash of everything exported for a team (total points, feedback, mtime and size of Korrektur.pdf)
+        """
+        pdf_stat = None
+        if pdf_path is not None:
+            try:
+                st = os.stat(pdf_path)
+                pdf_stat = [st.st_mtime_ns, st.st_size]
+            except OSError:
+                pass
+        return hashlib.sha1(json.dumps([points, feedback, pdf_stat], ensure_ascii=False).encode("utf-8")).hexdigest()
 
-        # export status.csv
-        status_df.to_csv(path_to_status_csv, index=False, quoting=csv.QUOTE_ALL, float_format="%g")
+    def open_export_folder(self, zip_path: str):
+        """
+        Asks whether the exported zip file should be shown and opens its folder (GUI thread).
 
-        shutil.make_archive(base_name=os.path.join(self.path_to_output, self.dir_name, zip_name),  # Destination
-                            format="zip",  # Extension
-                            root_dir=os.path.join(self.path_to_output, self.dir_name, zip_name))  # Folder to zip
-        logging.debug(f"export: Converted to zip file "
-                      f"\"{os.path.join(self.path_to_output, self.dir_name, zip_name)}.zip\"")
+        :param zip_path: Path to the exported zip file
+        """
         open_folder = messagebox.askyesno(title="AuD-GUI :D - Export",
-                                          message=f"Datei \""
-                                                  f"{os.path.join(self.path_to_output, self.dir_name, zip_name)}.zip"
-                                                  f"\" anzeigen?")
+                                          message=f"Datei \"{zip_path}\" anzeigen?")
         if open_folder:
             # os.startfile(os.path.join(self.path_to_output, self.dir_name))
             # this failed on linux -> fixed it with:
@@ -621,5 +1326,4 @@ class Manager:
             except Exception as e:
                 logging.error(f"export: Failed to open folder {folder_path}: {e}")
 
-            logging.debug(f"export: Open in file explorer: "
-                          f"\"{os.path.join(self.path_to_output, self.dir_name, zip_name)}.zip\"")
\ No newline at end of file
+            logging.debug(f"export: Open in file explorer: \"{zip_path}\"")
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import json
+import sqlite3
+import threading
+
+from src.io_utils import atomic_write_json
+
+
+# Single file store of a correction, replaces the state.json files of the teams
+SESSION_DB = "session.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS teams (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    confirmed INTEGER NOT NULL,
+    compile_error INTEGER NOT NULL,
+    plagiat INTEGER NOT NULL,
+    total REAL NOT NULL,
+    total_max REAL NOT NULL,
+    state_file TEXT NOT NULL,
+    feedback TEXT NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS teams_confirmed ON teams (confirmed);
+CREATE TABLE IF NOT EXISTS task_points (
+    team_id INTEGER NOT NULL,
+    class TEXT NOT NULL,
+    task TEXT NOT NULL,
+    actual REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (team_id, class, task)
+);
+"""
+
+
+class SessionStore:
+    def __init__(self, session_dir: str):
+        """
+        SQLite database holding the states of all teams of a correction (flags, points, feedback and the complete
+        state). The state.json files are only written for exports and merges.
+        Thread-safe, since the autosave writes on a background thread.
+
+        :param session_dir: Directory of the correction
+        """
+        self.path = os.path.join(session_dir, SESSION_DB)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def exists(session_dir: str):
+        """
+        :return: True if the correction in session_dir uses a session store
+        """
+        return os.path.isfile(os.path.join(session_dir, SESSION_DB))
+
+    def save_states(self, states: list):
+        """
+        Inserts or updates states in a single transaction.
+
+        :param states: List of (position in the team list, state data as saved in state.json)
+        """
+        with self.lock, self.connection:
+            for position, data in states:
+                comment = data["comment"]
+                state = {k: v for k, v in data.items() if k != "auto_correction_result"}
+                self.connection.execute(
+                    "INSERT INTO teams (id, position, confirmed, compile_error, plagiat, total, total_max, state_file, "
+                    "feedback, state) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET position = excluded.position, confirmed = excluded.confirmed, "
+                    "compile_error = excluded.compile_error, plagiat = excluded.plagiat, total = excluded.total, "
+                    "total_max = excluded.total_max, state_file = excluded.state_file, feedback = excluded.feedback, "
+                    "state = excluded.state",
+                    (int(data["id"]), position, int(data["confirmed"]), int(comment["compile_error"]),
+                     int(comment["plagiat"]), comment["total_points"]["actual"], comment["total_points"]["max"],
+                     data["status_filepath"], data.get("auto_correction_result", ""),
+                     json.dumps(state, ensure_ascii=False)))
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO task_points (team_id, class, task, actual, max) VALUES (?, ?, ?, ?, ?)",
+                    [(int(data["id"]), c["title"], t["title"], t["points"]["actual"], t["points"]["max"])
+                     for c in comment["classes"] for t in c["tasks"]])
+
+    def entries(self):
+        """
+        :return: Entries of all teams in team list order, same format as the manifest entries
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT id, confirmed, total, total_max, state_file FROM teams "
+                                           "ORDER BY position").fetchall()
+        return [{"id": team_id,
+                 "confirmed": bool(confirmed),
+                 "total_points": {"actual": total, "max": total_max},
+                 "state_file": state_file} for team_id, confirmed, total, total_max, state_file in rows]
+
+    def load(self, team_id: int):
+        """
+        :return: Complete state data of a team (as saved in state.json)
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT feedback, state FROM teams WHERE id = ?", (int(team_id),)).fetchone()
+        if row is None:
+            raise KeyError(f"Team {team_id} not in \"{self.path}\"")
+        data = json.loads(row[1])
+        data["auto_correction_result"] = row[0]
+        return data
+
+    def write_json_files(self):
+        """
+        Writes the state.json files of all teams to their original location (for merges).
+        """
+        with self.lock:
+            team_ids = [r[0] for r in self.connection.execute("SELECT id FROM teams").fetchall()]
+        for team_id in team_ids:
+            data = self.load(team_id)
+            atomic_write_json(data["status_filepath"], data)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,92 @@
+import numpy as np
+
+from src.comment_utils import Template, Grading
+
+
+class PointsMatrix:
+    def __init__(self, template: Template, n_teams: int):
+        """
+        Points of all teams as teams x tasks matrix (same order as the team list and the flat task order of the
+        template). Rows are set with set_row and kept in sync by the manager, statistics are computed from the
+        whole matrix at once.
+
+        :param template: Shared template of the correction
+        :param n_teams: Number of teams
+        """
+        self.template = template
+        self.points = np.zeros((n_teams, len(template.task_titles)))
+        self.totals = np.zeros(n_teams)
+        # Teams graded with another template are not part of the statistics
+        self.valid = np.zeros(n_teams, dtype=bool)
+        # Teams with compile error or plagiat only count with their total (0 like in the export), not their tasks
+        self.scored = np.zeros(n_teams, dtype=bool)
+        # tasks x classes, points @ class_matrix => class sums of all teams
+        self.class_matrix = np.zeros((len(template.task_titles), len(template.class_titles)))
+        for i in range(len(template.class_titles)):
+            self.class_matrix[template.class_start[i]:template.class_start[i + 1], i] = 1.
+        self.task_max = np.array(template.task_max)
+        self.class_max = np.array(template.class_max, dtype=float)
+
+    def set_row(self, row: int, grading: Grading):
+        """
+        Copies the points of a team into the matrix.
+
+        :param row: Index of the team in the team list
+        """
+        if grading.template is not self.template:
+            self.valid[row] = False
+            self.scored[row] = False
+            return
+        self.points[row] = np.frombuffer(grading.points, dtype=np.float64)
+        self.totals[row] = grading.total
+        self.valid[row] = True
+        self.scored[row] = not (grading.compile_error or grading.plagiat)
+
+    def n_teams(self):
+        """
+        :return: Number of teams included in the statistics
+        """
+        return int(np.count_nonzero(self.valid))
+
+    def n_flagged(self):
+        """
+        :return: Number of teams with compile error or plagiat (not part of the task and class statistics)
+        """
+        return int(np.count_nonzero(self.valid & ~self.scored))
+
+    def task_stats(self):
+        """
+        :return: Dict of arrays (one value per task) with keys "mean", "median", "min", "max" and "mean_lost"
+                 (points lost on average), None if there are no teams without compile error or plagiat
+        """
+        p = self.points[self.scored]
+        if p.shape[0] == 0:
+            return None
+        mean = p.mean(axis=0)
+        return {"mean": mean,
+                "median": np.median(p, axis=0),
+                "min": p.min(axis=0),
+                "max": p.max(axis=0),
+                "mean_lost": self.task_max - mean}
+
+    def class_sums(self):
+        """
+        :return: teams x classes matrix of the class points (teams without compile error or plagiat)
+        """
+        return self.points[self.scored] @ self.class_matrix
+
+    def class_histograms(self, bins: int = 5):
+        """
+        :param bins: Number of equally sized bins between 0 and the max points of the class
+        :return: List of (counts, bin edges) per class
+        """
+        sums = self.class_sums()
+        return [np.histogram(sums[:, i], bins=bins, range=(0., max(self.class_max[i], 1.)))
+                for i in range(sums.shape[1])]
+
+    def total_histogram(self, bins: int = 10):
+        """
+        :param bins: Number of equally sized bins between 0 and the max total points
+        :return: (counts, bin edges) of the total points
+        """
+        return np.histogram(self.totals[self.valid], bins=bins, range=(0., max(self.template.total_max, 1.)))